@@ -1,10 +1,19 @@
 import re
+from time import time
 
-from fastapi import Cookie, Header, HTTPException
+from fastapi import Cookie, Depends, Header, HTTPException
 
+from . import config
 from .models.user import get_user
+from .resources import redis
 from .schemas.user import UserInfo
-from .sessions import is_valid_csrf, session_exists
+from .sessions import (
+    create_session,
+    delete_session,
+    delete_sessions,
+    is_valid_csrf,
+)
+from .signed_sessions import create_token, denylist, parse_token
 
 
 async def authenticated_user(
@@ -16,17 +25,54 @@ async def authenticated_user(
     Obs: Cookie(...) and Header(...) would raise 'field required' errors
          instead of 401 errors.
          So, we must use Cookie(None) instead of Cookie(...)
+
+    The session and the cached user are fetched in a single Redis round trip.
+    Signed sessions are verified locally.
     """
     if not (
         session_id
         and x_csrf_token
         and (match := re.match(r'user:(\d+):', session_id))
         and is_valid_csrf(session_id, x_csrf_token)
-        and await session_exists(session_id)
     ):
         raise HTTPException(status_code=401)
     user_id = int(match.group(1))
-    user = await get_user(user_id)
+    if config.SESSION_BACKEND == 'signed':
+        token = parse_token(session_id)
+        if not token or denylist.is_revoked(token):
+            raise HTTPException(status_code=401)
+        user = await get_user(user_id)
+    else:
+        user = await get_user(user_id, session_id)
     if not user:
         raise HTTPException(status_code=401)
     return user
+
+
+async def admin_user(user: UserInfo = Depends(authenticated_user)) -> UserInfo:
+    if user.email.lower() not in config.ADMIN_EMAILS:
+        raise HTTPException(status_code=403)
+    return user
+
+
+async def create_user_session(user_id: int) -> str:
+    prefix = f'user:{user_id}'
+    if config.SESSION_BACKEND == 'signed':
+        return create_token(prefix)
+    return await create_session(prefix)
+
+
+async def delete_user_session(session_id: str) -> None:
+    if config.SESSION_BACKEND == 'signed':
+        if token := parse_token(session_id):
+            await denylist.revoke(redis, token.signature, token.expires)
+    else:
+        await delete_session(session_id)
+
+
+async def delete_user_sessions(user_id: int) -> None:
+    prefix = f'user:{user_id}'
+    if config.SESSION_BACKEND == 'signed':
+        await denylist.revoke(redis, prefix, int(time()))
+    else:
+        await delete_sessions(prefix)
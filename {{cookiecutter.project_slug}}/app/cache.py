@@ -0,0 +1,128 @@
+"""
+In-process caches kept in front of Redis.
+
+Every worker has its own copy of each cache,
+so invalidations are broadcast to all of them through Redis pub/sub.
+"""
+
+import asyncio
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Hashable, Optional
+
+from aioredis import Redis
+from loguru import logger
+
+INVALIDATION_CHANNEL = 'cache:invalidate'
+
+caches: dict[str, 'LocalCache'] = {}
+
+
+class LocalCache:
+    """
+    Bounded LRU cache whose entries expire ``ttl`` seconds after being set.
+
+    Keys are normalized to ``str`` so that they can travel through pub/sub.
+    A ``maxsize`` of 0 disables the cache.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: float) -> None:
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # incremented on every invalidation.
+        # See set() for details.
+        self.generation = 0
+        self._data: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        caches[name] = self
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        key = str(key)
+        entry = self._data.get(key)
+        if entry is None or entry[0] < monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(
+        self, key: Hashable, value: Any, generation: Optional[int] = None
+    ) -> None:
+        """
+        Stores ``value`` under ``key``.
+
+        If ``generation`` (read before fetching ``value`` from the source)
+        is no longer current, an invalidation happened in the meantime
+        and ``value`` might be stale, so it is not stored.
+        """
+        if not self.maxsize or (
+            generation is not None and generation != self.generation
+        ):
+            return
+        key = str(key)
+        self._data[key] = (monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        self.generation += 1
+        self._data.pop(str(key), None)
+
+    def clear(self) -> None:
+        self.generation += 1
+        self._data.clear()
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    async def invalidate(self, redis: Redis, key: Hashable) -> None:
+        """
+        Removes ``key`` from this cache in every worker
+        """
+        self.pop(key)
+        await redis.publish(INVALIDATION_CHANNEL, f'{self.name}:{key}')
+
+
+def clear_caches() -> None:
+    for cache in caches.values():
+        cache.clear()
+
+
+async def listen_invalidations(
+    redis: Redis, subscribed: Optional[asyncio.Event] = None
+) -> None:
+    """
+    Applies the invalidations published by all workers.
+    Caches are cleared whenever the subscription is (re)established
+    because messages might have been lost while it was down.
+    """
+    while True:
+        pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(INVALIDATION_CHANNEL)
+            clear_caches()
+            if subscribed:
+                subscribed.set()
+            async for message in pubsub.listen():
+                name, _, key = message['data'].decode().partition(':')
+                if cache := caches.get(name):
+                    cache.pop(key)
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            logger.warning(f'Cache invalidation listener failed: {error!r}')
+            clear_caches()
+            await asyncio.sleep(1)
+        finally:
+            await pubsub.close()
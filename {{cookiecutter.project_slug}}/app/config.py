@@ -1,6 +1,7 @@
 import os
 import secrets
 from datetime import timedelta
+from ipaddress import ip_network
 
 ENV = os.getenv('ENV', 'production').lower()
 if ENV not in ('production', 'development', 'testing'):
@@ -13,6 +14,42 @@ TESTING = ENV == 'testing'
 
 LOG_LEVEL = os.getenv('LOG_LEVEL') or DEBUG and 'DEBUG' or 'INFO'
 os.environ['LOGURU_DEBUG_COLOR'] = '<fg #777>'
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+if LOG_FORMAT not in ('text', 'json'):
+    raise ValueError(
+        f"LOG_FORMAT={LOG_FORMAT} is not valid. It should be 'text' or 'json'"
+    )
+# messages waiting to be written. Beyond that, they are dropped
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10_000))
+ACCESS_LOG = os.getenv('ACCESS_LOG', 'true').lower() == 'true'
+# fraction of the requests whose access log and debug messages are written.
+# LOG_SAMPLE_RATES sets it by route. e.g.: /metrics=0,/users/me=0.01
+# Requests that fail with 5xx are always logged.
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', 1))
+LOG_SAMPLE_RATES = {
+    route.strip(): float(rate)
+    for route, _, rate in (
+        item.partition('=')
+        for item in os.getenv('LOG_SAMPLE_RATES', '').split(',')
+    )
+    if route.strip()
+}
+# fraction of the requests that are traced (0 disables tracing).
+# Spans are written as OTLP JSON lines to TRACE_EXPORT:
+# a file path or a UDP socket (udp://host:port). See app.tracing
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 0))
+TRACE_EXPORT = os.getenv('TRACE_EXPORT', '/tmp/traces.jsonl')
+TRACE_QUEUE_SIZE = int(os.getenv('TRACE_QUEUE_SIZE', 10_000))
+# client networks allowed to read /metrics (comma separated).
+# Behind a reverse proxy, don't forward /metrics to the app
+METRICS_NETWORKS = [
+    ip_network(network.strip())
+    for network in os.getenv(
+        'METRICS_NETWORKS',
+        '127.0.0.0/8,::1/128,10.0.0.0/8,172.16.0.0/12,192.168.0.0/16',
+    ).split(',')
+    if network.strip()
+]
 
 DB_PASSWORD = os.getenv('DB_PASSWORD', 'development_1234')
 DB_HOST = os.getenv('DB_HOST', 'localhost')
@@ -22,15 +59,136 @@ DATABASE_URL = (
     os.getenv('DATABASE_URL')
     or f'postgresql://postgres:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
 )
+# read replicas: comma separated database URLs
+DATABASE_REPLICA_URLS = [
+    url.strip()
+    for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',')
+    if url.strip()
+]
+# seconds a failing replica stays out of the rotation
+REPLICA_EJECTION_TIME = int(os.getenv('REPLICA_EJECTION_TIME', 30))
+# seconds a client reads from the primary after writing something
+READ_YOUR_WRITES_WINDOW = int(os.getenv('READ_YOUR_WRITES_WINDOW', 5))
+# seconds Redis keeps records read from replicas, which might be lagging
+REPLICA_CACHE_TTL = int(os.getenv('REPLICA_CACHE_TTL', 60))
 REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
 REDIS_PORT = os.getenv('REDIS_PORT', '6379')
 REDIS_URL = os.getenv('REDIS_URL') or f'redis://{REDIS_HOST}:{REDIS_PORT}'
 
+# Processes and connection pools.
+# Each hypercorn worker has its own pools, so the connections of the server
+# (Postgres max_connections, Redis maxclients) are split among the workers
+# of all APP_INSTANCES (containers) by default.
+CPUS = (
+    len(os.sched_getaffinity(0))  # CPUs available to the container
+    if hasattr(os, 'sched_getaffinity')
+    else os.cpu_count() or 1
+)
+WORKERS = int(os.getenv('WORKERS', 0)) or CPUS  # same default as the Dockerfile
+APP_INSTANCES = int(os.getenv('APP_INSTANCES', 1))
+# Postgres max_connections and Redis maxclients, and how many of them are
+# left to other clients (migrations, mail worker, psql...)
+DB_MAX_CONNECTIONS = int(os.getenv('DB_MAX_CONNECTIONS', 100))
+DB_RESERVED_CONNECTIONS = int(os.getenv('DB_RESERVED_CONNECTIONS', 10))
+REDIS_MAX_CLIENTS = int(os.getenv('REDIS_MAX_CLIENTS', 10_000))
+REDIS_RESERVED_CLIENTS = int(os.getenv('REDIS_RESERVED_CLIENTS', 100))
+_processes = APP_INSTANCES * WORKERS
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 0)) or max(
+    2, min(20, (DB_MAX_CONNECTIONS - DB_RESERVED_CONNECTIONS) // _processes)
+)
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', 0)) or max(
+    1, DB_POOL_MAX_SIZE // 4
+)
+REDIS_POOL_MAX_SIZE = int(os.getenv('REDIS_POOL_MAX_SIZE', 0)) or max(
+    4, min(50, (REDIS_MAX_CLIENTS - REDIS_RESERVED_CLIENTS) // _processes)
+)
+# Redis connections opened by the warm-up, before serving
+REDIS_POOL_MIN_SIZE = int(os.getenv('REDIS_POOL_MIN_SIZE', 0)) or max(
+    1, REDIS_POOL_MAX_SIZE // 4
+)
+# seconds a request waits for a free Redis connection
+REDIS_POOL_TIMEOUT = float(os.getenv('REDIS_POOL_TIMEOUT', 5))
+
+# Postgres and Redis are checked every HEALTH_CHECK_INTERVAL seconds
+# for /readyz. A check slower than HEALTH_CHECK_TIMEOUT seconds fails.
+HEALTH_CHECK_INTERVAL = float(os.getenv('HEALTH_CHECK_INTERVAL', 5))
+HEALTH_CHECK_TIMEOUT = float(os.getenv('HEALTH_CHECK_TIMEOUT', 1))
+
 SECRET_KEY = bytes(os.getenv('SECRET_KEY', ''), 'utf-8') or secrets.token_bytes(
     32
 )
+# keys that signed tokens which must still be accepted. Comma separated.
+PREVIOUS_SECRET_KEYS = [
+    bytes(key.strip(), 'utf-8')
+    for key in os.getenv('PREVIOUS_SECRET_KEYS', '').split(',')
+    if key.strip()
+]
+# user sessions are kept in 'redis' or carried by 'signed' tokens.
+# See app.signed_sessions
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'redis').lower()
+if SESSION_BACKEND not in ('redis', 'signed'):
+    raise ValueError(
+        f'SESSION_BACKEND={SESSION_BACKEND} is not valid. '
+        "It should be 'redis' or 'signed'"
+    )
+# seconds for a revoked signed session to be seen by all processes
+SESSION_DENYLIST_REFRESH = int(os.getenv('SESSION_DENYLIST_REFRESH', 5))
 SESSION_ID_LENGTH = int(os.getenv('SESSION_ID_LENGTH', 16))
 SESSION_LIFETIME = int(timedelta(days=7).total_seconds())
+# sliding sessions are extended by authenticated requests, but only when
+# less than SESSION_REFRESH_THRESHOLD seconds are left. So, at most one
+# refresh happens per (SESSION_LIFETIME - SESSION_REFRESH_THRESHOLD) seconds.
+SESSION_SLIDING = os.getenv('SESSION_SLIDING', 'false').lower() == 'true'
+SESSION_REFRESH_THRESHOLD = int(
+    os.getenv('SESSION_REFRESH_THRESHOLD', SESSION_LIFETIME // 2)
+)
+
+# in-process cache of user records. USER_CACHE_SIZE=0 disables it.
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 10_000))
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 60))
+# most recently cached users loaded into the caches at startup. 0 disables it
+USER_PRELOAD_SIZE = int(os.getenv('USER_PRELOAD_SIZE', 0))
+# seconds Redis keeps user records read from the primary database
+USER_REDIS_CACHE_TTL = int(
+    os.getenv('USER_REDIS_CACHE_TTL', timedelta(days=1).total_seconds())
+)
+
+# rate limits of the confirmation email endpoints: requests per period (seconds)
+EMAIL_RATE_LIMIT = int(os.getenv('EMAIL_RATE_LIMIT', 1))
+EMAIL_RATE_PERIOD = int(os.getenv('EMAIL_RATE_PERIOD', 3600))
+IP_RATE_LIMIT = int(os.getenv('IP_RATE_LIMIT', 20))
+IP_RATE_PERIOD = int(os.getenv('IP_RATE_PERIOD', 3600))
+# reverse proxies whose X-Forwarded-For header is trusted (comma separated
+# networks). Otherwise, the client address is the one of the connection
+TRUSTED_PROXIES = [
+    ip_network(network.strip())
+    for network in os.getenv('TRUSTED_PROXIES', '').split(',')
+    if network.strip()
+]
+
+# password hashing runs in a pool of 'process'es or 'thread's.
+# Hashes beyond HASH_POOL_SIZE + HASH_MAX_QUEUE get a 503 response.
+HASH_EXECUTOR = os.getenv('HASH_EXECUTOR', 'process').lower()
+if HASH_EXECUTOR not in ('process', 'thread'):
+    raise ValueError(
+        f'HASH_EXECUTOR={HASH_EXECUTOR} is not valid. '
+        "It should be 'process' or 'thread'"
+    )
+# Default: the CPUs are shared by the hashing pools of all workers
+HASH_POOL_SIZE = int(os.getenv('HASH_POOL_SIZE', 0)) or max(1, CPUS // WORKERS)
+HASH_MAX_QUEUE = int(os.getenv('HASH_MAX_QUEUE', 32))
+
+# users allowed to use the admin endpoints. Comma separated
+ADMIN_EMAILS = {
+    email.strip().lower()
+    for email in os.getenv('ADMIN_EMAILS', '').split(',')
+    if email.strip()
+}
+# users inserted per COPY by the bulk import
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', 1000))
+# users per page of the user listing (GET /users)
+USERS_PAGE_SIZE = int(os.getenv('USERS_PAGE_SIZE', 100))
+USERS_PAGE_MAX_SIZE = int(os.getenv('USERS_PAGE_MAX_SIZE', 1000))
 
 PASSWORD_MIN_LENGTH = int(os.getenv('PASSWORD_MIN_LENGTH', 15))
 PASSWORD_MIN_VARIETY = int(os.getenv('PASSWORD_MIN_VARIETY', 5))
@@ -42,6 +200,17 @@ MAIL_FROM = os.environ['MAIL_FROM']
 MAIL_PORT = int(os.environ['MAIL_PORT'])
 MAIL_SERVER = os.environ['MAIL_SERVER']
 MAIL_FROM_NAME = os.environ['MAIL_FROM_NAME']
+MAIL_STARTTLS = os.getenv('MAIL_STARTTLS', 'true').lower() == 'true'
+MAIL_SUPPRESS_SEND = DEBUG or TESTING
+# messages waiting to be sent. Beyond that, new emails are refused
+MAIL_QUEUE_MAXLEN = int(os.getenv('MAIL_QUEUE_MAXLEN', 1_000_000))
+# mail worker
+MAIL_WORKER_CONNECTIONS = int(os.getenv('MAIL_WORKER_CONNECTIONS', 4))
+MAIL_BATCH_SIZE = int(os.getenv('MAIL_BATCH_SIZE', 50))
+MAIL_MAX_ATTEMPTS = int(os.getenv('MAIL_MAX_ATTEMPTS', 6))
+MAIL_RETRY_DELAY = int(os.getenv('MAIL_RETRY_DELAY', 30))  # doubles each attempt
+# seconds before messages of a dead worker are taken over by another one
+MAIL_CLAIM_IDLE_TIME = int(os.getenv('MAIL_CLAIM_IDLE_TIME', 300))
 
 APP_URL = os.environ['APP_URL']
 APP_NAME = os.environ['APP_NAME']
@@ -0,0 +1,449 @@
+"""
+Database whose request transactions are started lazily, by the first query,
+routing of reads to replicas and precompiled statements.
+"""
+
+import asyncio
+from contextlib import contextmanager
+from contextvars import Context, ContextVar
+from time import monotonic, perf_counter
+from typing import (
+    Any,
+    AsyncGenerator,
+    Awaitable,
+    Callable,
+    Coroutine,
+    Iterator,
+    Optional,
+    TypeVar,
+    Union,
+)
+
+import asyncpg
+import databases
+from asyncpg.exceptions import (
+    InterfaceError,
+    PostgresConnectionError,
+    PostgresError,
+)
+from databases.core import Connection, Transaction
+from loguru import logger
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql import ClauseElement
+
+from .metrics import DB_POOL_CONNECTIONS, DB_QUERY_DURATION
+from .tracing import CLIENT, Span, child_span, finish, span
+
+T = TypeVar('T')
+dialect = postgresql.dialect(paramstyle='pyformat')
+statements: dict[str, 'Statement'] = {}
+
+
+class Statement:
+    """
+    SQLAlchemy query compiled only once, to SQL with asyncpg's $n parameters.
+
+    Values are passed by bind parameter name (see sqlalchemy.bindparam).
+    asyncpg keeps the prepared statement of each SQL in every connection,
+    so statements are neither compiled nor prepared again.
+    Column types that need bind or result processors are not supported.
+    """
+
+    def __init__(self, name: str, query: ClauseElement) -> None:
+        compiled = query.compile(
+            dialect=dialect, compile_kwargs={'render_postcompile': True}
+        )
+        self.name = name
+        self.defaults = compiled.params
+        self.params = sorted(compiled.params)
+        self.sql = compiled.string % {
+            param: f'${i}' for i, param in enumerate(self.params, start=1)
+        }
+        statements[name] = self
+
+    def args(self, values: Optional[dict] = None) -> list[Any]:
+        values = {**self.defaults, **values} if values else self.defaults
+        return [values[param] for param in self.params]
+
+    def __str__(self) -> str:
+        return self.sql
+
+
+Query = Union[ClauseElement, str, Statement]
+
+
+def _describe_query(current: Span, query: Query) -> None:
+    if isinstance(query, Statement):
+        sql = query.sql
+    elif isinstance(query, ClauseElement):
+        sql = str(query.compile(dialect=dialect))
+    else:
+        sql = query
+    current.attributes['db.system'] = 'postgresql'
+    current.attributes['db.statement'] = sql
+
+
+@contextmanager
+def query_span(operation: str, query: Query) -> Iterator[Optional[Span]]:
+    """
+    Span of a query. The SQL is only rendered if the request is traced
+    """
+    with span(f'postgres {operation}', CLIENT) as current:
+        if current is not None:
+            _describe_query(current, query)
+        yield current
+
+
+async def prime_connection(connection: asyncpg.Connection) -> None:
+    """
+    Prepares all statements in each new pool connection (asyncpg's init),
+    so that the first queries skip the type introspection and the preparation.
+
+    A cursor prepares its statement through the statement cache of the
+    connection, which the queries use as well, and binds it without running
+    it. Cursors only exist in transactions, which are rolled back.
+    """
+    for statement in statements.values():
+        transaction = connection.transaction()
+        await transaction.start()
+        try:
+            args = [None] * len(statement.params)
+            await connection.cursor(statement.sql, *args)
+        except PostgresError as error:  # e.g. not migrated yet
+            logger.debug('{} not prepared: {!r}', statement.name, error)
+        finally:
+            await transaction.rollback()
+
+
+class RequestTransaction:
+    """
+    Transaction that wraps a request.
+
+    It is only started by the first query of the request,
+    so requests that don't touch the database never acquire a connection.
+    """
+
+    def __init__(self, database: 'Database', readonly: bool = False) -> None:
+        self.database = database
+        self.readonly = readonly
+        self.connection: Optional[Connection] = None
+        self.transaction: Optional[Transaction] = None
+        self.wrote = False
+        # the client wrote recently, so it must read from the primary
+        self.read_your_writes = False
+        # run once the transaction is committed. See after_commit()
+        self.on_commit: list[Callable[[], Awaitable[Any]]] = []
+        self._lock = asyncio.Lock()
+
+    @property
+    def started(self) -> bool:
+        return self.transaction is not None
+
+    async def start(self) -> None:
+        async with self._lock:  # concurrent queries of the same request
+            if self.started:
+                return
+            connection = self.database.connection()
+            await connection.__aenter__()
+            # asyncpg refuses read-only nested transactions,
+            # such as the ones inside the transaction that wraps each test
+            readonly = (
+                self.readonly
+                and not connection.raw_connection.is_in_transaction()
+            )
+            transaction = connection.transaction(readonly=readonly)
+            try:
+                await transaction.start()
+            except BaseException:
+                await connection.__aexit__(None, None, None)
+                raise
+            self.connection = connection
+            self.transaction = transaction
+
+    async def finish(self, commit: bool) -> None:
+        if self.transaction is None or self.connection is None:
+            return
+        try:
+            if commit:
+                await self.transaction.commit()
+            else:
+                await self.transaction.rollback()
+        finally:
+            await self.connection.__aexit__(None, None, None)
+            self.transaction = None
+            self.connection = None
+            callbacks, self.on_commit = self.on_commit, []
+        if commit:
+            for callback in callbacks:
+                try:
+                    await callback()
+                except Exception:  # the transaction is already committed
+                    logger.exception('After commit callback failed')
+
+
+request_transaction: ContextVar[Optional[RequestTransaction]] = ContextVar(
+    'request_transaction', default=None
+)
+
+
+async def after_commit(callback: Callable[[], Awaitable[Any]]) -> None:
+    """
+    Runs ``callback`` once the current request transaction is committed,
+    or right away outside request transactions.
+
+    Cache invalidations go through here, so that no one can cache
+    the old records again between the invalidation and the commit.
+    """
+    transaction = request_transaction.get()
+    if transaction is not None and transaction.started:
+        transaction.on_commit.append(callback)
+    else:
+        await callback()
+
+
+async def run_detached(coroutine: Coroutine[Any, Any, T]) -> T:
+    """
+    Runs ``coroutine`` outside the request transaction, on a connection
+    of its own, so that its transactions are committed as they finish.
+
+    It runs in a task whose context starts empty: the connection of the
+    request, bound to the request context, isn't inherited.
+    """
+    return await Context().run(asyncio.ensure_future, coroutine)
+
+
+class Database(databases.Database):
+    """
+    Starts the pending request transaction (see DBTransactionMiddleware)
+    before running any query.
+
+    Queries can also be Statements, which run straight on asyncpg.
+    """
+
+    def connection(self) -> Connection:
+        # the request connection is shared even with tasks spawned by the request
+        transaction = request_transaction.get()
+        if (
+            transaction is not None
+            and transaction.database is self
+            and transaction.connection is not None
+        ):
+            return transaction.connection
+        return super().connection()
+
+    async def _prepared(
+        self, method: str, statement: Statement, values: Optional[dict]
+    ) -> Any:
+        async with self.connection() as connection:
+            async with connection._query_lock:  # as databases' own queries
+                return await getattr(connection.raw_connection, method)(
+                    statement.sql, *statement.args(values)
+                )
+
+    async def _begin(self, write: bool = False) -> None:
+        transaction = request_transaction.get()
+        if transaction is None or transaction.database is not self:
+            return
+        if not transaction.started:
+            await transaction.start()
+        transaction.wrote |= write
+
+    def _observe(self, operation: str, start: float) -> None:
+        DB_QUERY_DURATION.labels(operation).observe(perf_counter() - start)
+        pool = getattr(self._backend, '_pool', None)  # asyncpg pool
+        if pool is not None:
+            DB_POOL_CONNECTIONS.labels('max').set(pool.get_max_size())
+            DB_POOL_CONNECTIONS.labels('open').set(pool.get_size())
+            DB_POOL_CONNECTIONS.labels('idle').set(pool.get_idle_size())
+
+    async def fetch_all(
+        self, query: Query, values: Optional[dict] = None
+    ) -> list[Any]:
+        await self._begin()
+        with query_span('fetch_all', query):
+            start = perf_counter()
+            try:
+                if isinstance(query, Statement):
+                    return await self._prepared('fetch', query, values)
+                return await super().fetch_all(query, values)
+            finally:
+                self._observe('fetch_all', start)
+
+    async def fetch_one(self, query: Query, values: Optional[dict] = None) -> Any:
+        await self._begin()
+        with query_span('fetch_one', query):
+            start = perf_counter()
+            try:
+                if isinstance(query, Statement):
+                    return await self._prepared('fetchrow', query, values)
+                return await super().fetch_one(query, values)
+            finally:
+                self._observe('fetch_one', start)
+
+    async def fetch_val(
+        self, query: Query, values: Optional[dict] = None, column: Any = 0
+    ) -> Any:
+        await self._begin()
+        with query_span('fetch_val', query):
+            start = perf_counter()
+            try:
+                if isinstance(query, Statement):
+                    record = await self._prepared('fetchrow', query, values)
+                    return None if record is None else record[column]
+                return await super().fetch_val(query, values, column)
+            finally:
+                self._observe('fetch_val', start)
+
+    async def execute(self, query: Query, values: Optional[dict] = None) -> Any:
+        await self._begin(write=True)
+        with query_span('execute', query):
+            start = perf_counter()
+            try:
+                if isinstance(query, Statement):
+                    return await self._prepared('execute', query, values)
+                return await super().execute(query, values)
+            finally:
+                self._observe('execute', start)
+
+    async def execute_many(self, query: Query, values: list) -> None:
+        await self._begin(write=True)
+        with query_span('execute_many', query):
+            start = perf_counter()
+            try:
+                return await super().execute_many(query, values)
+            finally:
+                self._observe('execute_many', start)
+
+    async def iterate(
+        self, query: Query, values: Optional[dict] = None
+    ) -> AsyncGenerator[Any, None]:
+        await self._begin()
+        # the span isn't made current: the consumer runs between the records
+        current = child_span('postgres iterate', CLIENT)
+        if current is not None:
+            _describe_query(current, query)
+        error: Optional[Exception] = None
+        start = perf_counter()
+        try:
+            async for record in super().iterate(query, values):
+                yield record
+        except Exception as exc:
+            error = exc
+            raise
+        finally:
+            self._observe('iterate', start)
+            if current is not None:
+                finish(current, error)
+
+
+class Replicas:
+    """
+    Routes reads to read replicas, in round-robin.
+
+    A replica that fails is ejected for ``ejection_time`` seconds
+    and the read falls back to the primary.
+    Reads go to the primary outside requests, in requests other than
+    GET and HEAD and shortly after the client wrote something
+    (read-your-writes).
+    """
+
+    def __init__(
+        self, urls: list[str], ejection_time: float, **options: Any
+    ) -> None:
+        self.databases = [Database(url, **options) for url in urls]
+        self.ejection_time = ejection_time
+        self._ejected_until = [0.0] * len(self.databases)
+        self._next = 0
+
+    async def connect(self) -> None:
+        await asyncio.gather(
+            *(self._connect(index) for index in range(len(self.databases)))
+        )
+
+    async def disconnect(self) -> None:
+        await asyncio.gather(
+            *(database.disconnect() for database in self.databases)
+        )
+
+    async def _connect(self, index: int) -> None:
+        try:
+            await self.databases[index].connect()
+        except (OSError, asyncio.TimeoutError, PostgresConnectionError) as error:
+            self._eject(index, error)
+
+    def _eject(self, index: int, error: Exception) -> None:
+        logger.warning(f'Replica {index} ejected: {error!r}')
+        self._ejected_until[index] = monotonic() + self.ejection_time
+
+    def in_use(self) -> bool:
+        """
+        Whether the reads of the current request can go to replicas
+        """
+        transaction = request_transaction.get()
+        return bool(
+            self.databases
+            and transaction is not None
+            and not transaction.read_your_writes
+            and transaction.readonly
+        )
+
+    def read_your_writes(self) -> bool:
+        """
+        Whether the client of the current request wrote recently.
+        Its reads must skip the caches, which might have been filled
+        from a lagging replica in the meantime
+        """
+        transaction = request_transaction.get()
+        return transaction is not None and transaction.read_your_writes
+
+    def _choose(self) -> Optional[int]:
+        if not self.in_use():
+            return None
+        now = monotonic()
+        for _ in range(len(self.databases)):
+            index = self._next % len(self.databases)
+            self._next += 1
+            if self._ejected_until[index] <= now:
+                return index
+        return None
+
+    async def read(
+        self, primary: Database, method: str, *args: Any
+    ) -> tuple[Any, bool]:
+        """
+        Runs ``method`` (e.g. fetch_one) on a replica or on the primary.
+        Returns the result and whether a replica answered it
+        """
+        index = self._choose()
+        if index is not None:
+            replica = self.databases[index]
+            try:
+                if not replica.is_connected:  # it failed to connect before
+                    await replica.connect()
+                return await getattr(replica, method)(*args), True
+            except (
+                OSError,
+                asyncio.TimeoutError,
+                PostgresConnectionError,
+                InterfaceError,
+            ) as error:
+                self._eject(index, error)
+        return await getattr(primary, method)(*args), False
+
+    async def fetch_all(
+        self,
+        primary: Database,
+        query: Query,
+        values: Optional[dict] = None,
+    ) -> list[Any]:
+        result, _ = await self.read(primary, 'fetch_all', query, values)
+        return result
+
+    async def fetch_one(
+        self,
+        primary: Database,
+        query: Query,
+        values: Optional[dict] = None,
+    ) -> Any:
+        result, _ = await self.read(primary, 'fetch_one', query, values)
+        return result
@@ -0,0 +1,158 @@
+"""
+Password hashing off the event loop.
+
+Argon2 is CPU bound on purpose, so hashes are computed in a bounded pool
+of processes (or threads) and requests beyond the queue limit are rejected
+right away instead of piling up.
+"""
+
+import asyncio
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from time import monotonic
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+from . import config
+from .metrics import (
+    PASSWORD_HASH_DURATION,
+    PASSWORD_HASH_QUEUE_WAIT,
+    PASSWORD_HASH_REJECTED,
+)
+from .tracing import span
+
+if TYPE_CHECKING:
+    from passlib.context import CryptContext
+
+
+@lru_cache(maxsize=None)
+def crypt_context() -> 'CryptContext':
+    """
+    Passlib is only imported by the processes that actually hash,
+    which keeps it out of the app startup
+    """
+    from passlib.context import CryptContext
+
+    return CryptContext(schemes=['argon2'])
+
+
+class HashingOverloadedError(Exception):
+    """
+    Raised when the hashing queue is full
+    """
+
+
+def _hash(password: str) -> str:
+    return crypt_context().hash(password)
+
+
+def _verify(password: str, hash: str) -> bool:
+    return crypt_context().verify(password, hash)
+
+
+def _hash_many(passwords: list[str]) -> list[str]:
+    return [crypt_context().hash(password) for password in passwords]
+
+
+def _timed(func: Callable, *args: Any) -> tuple[Any, float, float]:
+    """
+    Runs in the pool. monotonic() is system-wide, so it can be compared
+    to the submission time registered in the parent process.
+    """
+    start = monotonic()
+    result = func(*args)
+    return result, start, monotonic() - start
+
+
+class HashingPool:
+    def __init__(self, kind: str, size: int, max_queue: int) -> None:
+        self.kind = kind
+        self.size = size
+        self.max_queue = max_queue
+        self.pending = 0  # jobs queued or running
+        self._executor: Optional[Executor] = None
+
+    @property
+    def executor(self) -> Executor:
+        # created on first use because the event loop might not be running yet
+        if self._executor is None:
+            if self.kind == 'process':
+                # spawn avoids forking a process that already runs other threads
+                self._executor = ProcessPoolExecutor(
+                    self.size, mp_context=multiprocessing.get_context('spawn')
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    self.size, thread_name_prefix='hashing'
+                )
+        return self._executor
+
+    def shutdown(self) -> None:
+        """
+        Stops the workers without blocking the event loop: queued jobs are
+        cancelled and the running ones finish in the background.
+        The workers are started again if the pool is used again
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, func: Callable, *args: Any, items: int = 1) -> Any:
+        """
+        Runs ``func(*args)`` in the pool. A job that hashes several
+        passwords gives their number in ``items``, so that
+        PASSWORD_HASH_DURATION keeps measuring one password at a time
+        """
+        if self.pending >= self.size + self.max_queue:
+            PASSWORD_HASH_REJECTED.inc()
+            raise HashingOverloadedError()
+        self.pending += 1
+        submitted = monotonic()
+        with span(f'hashing {func.__name__}') as current:
+            try:
+                loop = asyncio.get_running_loop()
+                result, started, elapsed = await loop.run_in_executor(
+                    self.executor, _timed, func, *args
+                )
+            finally:
+                self.pending -= 1
+            queue_wait = max(started - submitted, 0)
+            if current is not None:
+                current.attributes['hashing.queue_wait_ms'] = queue_wait * 1000
+                current.attributes['hashing.duration_ms'] = elapsed * 1000
+        PASSWORD_HASH_QUEUE_WAIT.observe(queue_wait)
+        for _ in range(items):
+            PASSWORD_HASH_DURATION.observe(elapsed / items)
+        return result
+
+
+pool = HashingPool(
+    config.HASH_EXECUTOR, config.HASH_POOL_SIZE, config.HASH_MAX_QUEUE
+)
+
+
+async def hash_password(password: str) -> str:
+    return await pool.run(_hash, password)
+
+
+async def verify_password(password: str, hash: str) -> bool:
+    return await pool.run(_verify, password, hash)
+
+
+async def hash_passwords(passwords: list[str], chunk_size: int = 16) -> list[str]:
+    """
+    Hashes passwords in bulk, in chunks that keep all workers busy
+    but leave the queue to other requests
+    """
+    semaphore = asyncio.Semaphore(pool.size)
+
+    async def _hash_chunk(chunk: list[str]) -> list[str]:
+        async with semaphore:
+            return await pool.run(_hash_many, chunk, items=len(chunk))
+
+    chunks = []
+    for start in range(0, len(passwords), chunk_size):
+        end = start + chunk_size
+        chunks.append(passwords[start:end])
+    results = await asyncio.gather(*(_hash_chunk(chunk) for chunk in chunks))
+    return [hash for result in results for hash in result]
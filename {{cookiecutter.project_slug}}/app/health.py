@@ -0,0 +1,62 @@
+"""
+Health of the dependencies, for the readiness probe (/readyz).
+
+The dependencies are checked in the background, so probes never wait for
+them and never add load to them. The response is serialized once per check
+and served as it is. See app.middlewares.HealthMiddleware
+"""
+
+import asyncio
+from time import perf_counter, time
+from typing import Any, Awaitable, Callable
+
+import orjson as json
+from loguru import logger
+
+Check = Callable[[], Awaitable[Any]]
+
+
+class HealthChecker:
+    def __init__(
+        self, checks: dict[str, Check], interval: float, timeout: float
+    ) -> None:
+        self.checks = checks
+        self.interval = interval
+        self.timeout = timeout
+        self.healthy = False
+        self.body = json.dumps({'status': 'unknown', 'checks': {}})
+
+    async def _run(self, check: Check) -> dict[str, Any]:
+        start = perf_counter()
+        result: dict[str, Any]
+        try:
+            await asyncio.wait_for(check(), self.timeout)
+        except Exception as error:
+            result = {'status': 'down', 'error': repr(error)}
+        else:
+            result = {'status': 'ok'}
+        result['latency_ms'] = round((perf_counter() - start) * 1000, 3)
+        return result
+
+    async def check(self) -> None:
+        results = await asyncio.gather(
+            *(self._run(check) for check in self.checks.values())
+        )
+        checks = dict(zip(self.checks, results))
+        healthy = all(result['status'] == 'ok' for result in results)
+        if healthy != self.healthy:
+            log = logger.info if healthy else logger.warning
+            log('Health: {}', checks)
+        self.healthy = healthy
+        self.body = json.dumps(
+            {
+                'status': 'ok' if healthy else 'degraded',
+                'checked_at': time(),
+                'checks': checks,
+            }
+        )
+
+    async def keep_checking(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.check()
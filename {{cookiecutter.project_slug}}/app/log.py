@@ -0,0 +1,204 @@
+"""
+Logging setup.
+
+Messages are written by a background thread through a bounded queue,
+so logging never blocks the event loop. When the queue is full,
+messages are dropped and counted (log_messages_dropped metric).
+
+LOG_FORMAT=json writes one JSON object per line.
+
+Debug messages and access logs are sampled by request, per route.
+See LOG_SAMPLE_RATE and LOG_SAMPLE_RATES in app.config.
+
+Pass the values as arguments instead of formatting the message beforehand,
+so that nothing is formatted when the level is disabled::
+
+    logger.debug('user {} is cached', id)
+"""
+
+import logging
+import queue
+import sys
+import threading
+import traceback
+from contextvars import ContextVar
+from random import random
+from typing import TYPE_CHECKING, Any, Callable, Optional, TextIO
+
+import orjson as json
+from loguru import logger
+
+from . import config
+from .metrics import LOG_MESSAGES_DROPPED
+
+if TYPE_CHECKING:
+    from loguru import Record
+
+DEBUG_LEVEL = logger.level('DEBUG').no
+sink: Optional['BoundedSink'] = None
+
+
+class BoundedSink:
+    """
+    Loguru sink that hands messages over to a writer thread
+    """
+
+    def __init__(self, stream: TextIO, maxsize: int, serialize: bool) -> None:
+        self.stream = stream
+        self.serialize = serialize
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(maxsize)
+        self._thread = threading.Thread(
+            target=self._write, name='log_writer', daemon=True
+        )
+        self._thread.start()
+
+    def __call__(self, message: Any) -> None:
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            self.dropped += 1
+            LOG_MESSAGES_DROPPED.inc()
+
+    def _write(self) -> None:
+        while True:
+            message = self._queue.get()
+            try:
+                if self.serialize:
+                    self.stream.write(to_json(message.record))
+                else:
+                    self.stream.write(message)
+                if self._queue.empty():
+                    self.stream.flush()
+            except Exception:  # the writer must go on
+                traceback.print_exc(file=sys.__stderr__)
+            finally:
+                self._queue.task_done()
+
+    def flush(self) -> None:
+        """
+        Waits until all queued messages are written
+        """
+        self._queue.join()
+
+
+def to_json(record: dict[str, Any]) -> str:
+    data = {
+        'time': record['time'].isoformat(),
+        'level': record['level'].name,
+        'message': record['message'],
+        'name': record['name'],
+        'function': record['function'],
+        'line': record['line'],
+        **record['extra'],
+    }
+    if record['exception']:
+        data['exception'] = ''.join(
+            traceback.format_exception(*record['exception'])
+        )
+    return json.dumps(data, default=str).decode() + '\n'
+
+
+class RequestLog:
+    """
+    Sampling decision of the current request.
+
+    It is made once the request is routed, by route template
+    (e.g. /users/{id}), the same one as the metrics. ``route`` returns None
+    until then, and the messages logged meanwhile follow LOG_SAMPLE_RATE.
+    """
+
+    def __init__(self, route: Callable[[], Optional[str]]) -> None:
+        self.route = route
+        self._sampled: Optional[bool] = None
+
+    def decide(self, route: str) -> bool:
+        if self._sampled is None:
+            rate = config.LOG_SAMPLE_RATES.get(route, config.LOG_SAMPLE_RATE)
+            self._sampled = random() < rate
+        return self._sampled
+
+    @property
+    def sampled(self) -> bool:
+        if self._sampled is None:
+            route = self.route()
+            if route is None:  # not routed yet
+                return random() < config.LOG_SAMPLE_RATE
+            return self.decide(route)
+        return self._sampled
+
+
+request_log: ContextVar[Optional[RequestLog]] = ContextVar(
+    'request_log', default=None
+)
+
+
+def _sample(record: 'Record') -> bool:
+    if record['level'].no > DEBUG_LEVEL:
+        return True
+    log = request_log.get()
+    return log is None or log.sampled
+
+
+class InterceptHandler(logging.Handler):
+    """
+    Sends standard logging messages to loguru. ref: loguru README
+    """
+
+    levels = {
+        name: name
+        for name in ('TRACE', 'DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')
+    }
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # Get corresponding Loguru level if it exists
+        level = self.levels.get(record.levelname, record.levelno)
+
+        # Find caller from where originated the logged message.
+        # It is only worth the cost while developing
+        depth = 0
+        if config.DEBUG:
+            frame, depth = logging.currentframe(), 2
+            while frame.f_code.co_filename == logging.__file__:
+                frame = frame.f_back  # type: ignore
+                depth += 1
+
+        logger.opt(depth=depth, exception=record.exc_info).log(
+            level, record.getMessage()
+        )
+
+
+def setup_logger() -> None:
+    """
+    Configure Loguru's logger
+    """
+    global sink
+
+    # records below LOG_LEVEL are discarded before being created
+    logging.basicConfig(
+        handlers=[InterceptHandler()],
+        level=logger.level(config.LOG_LEVEL).no,
+        force=True,
+    )
+    logger.remove()  # remove standard handler
+    if sink is None:
+        sink = BoundedSink(
+            sys.stderr, config.LOG_QUEUE_SIZE, config.LOG_FORMAT == 'json'
+        )
+    options: dict[str, Any] = {}
+    if config.LOG_FORMAT == 'json':
+        options['format'] = '{message}'
+    else:
+        options['colorize'] = sys.stderr.isatty()
+    logger.add(
+        sink,
+        level=config.LOG_LEVEL,
+        filter=_sample,
+        backtrace=config.DEBUG,
+        **options,
+    )
+
+
+def flush_logger() -> None:
+    if sink is not None:
+        sink.flush()
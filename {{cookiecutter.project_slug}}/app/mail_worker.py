@@ -0,0 +1,314 @@
+"""
+Email worker.
+
+Sends the messages enqueued by the app (see app.mailer)
+through a pool of persistent SMTP connections.
+Failed messages are retried with exponential backoff
+and moved to a dead letter stream after MAIL_MAX_ATTEMPTS.
+Entries that can't be read are moved there right away.
+Messages of workers that died before acknowledging them are taken over
+after MAIL_CLAIM_IDLE_TIME seconds.
+
+Run as many workers as needed with::
+
+    python -m app.mail_worker
+
+In production, use the same Docker image as the app, overriding its command.
+"""
+
+import asyncio
+import os
+import signal
+import socket
+from email.message import EmailMessage
+from email.utils import formataddr
+from time import monotonic, time
+from typing import Optional
+
+import orjson as json
+from aioredis.exceptions import ResponseError
+from aiosmtplib import SMTP, SMTPServerDisconnected
+from loguru import logger
+
+from . import config
+from .log import flush_logger, setup_logger
+from .mailer import (
+    DEAD_LETTER_STREAM,
+    MAIL_GROUP,
+    MAIL_STREAM,
+    RETRY_QUEUE,
+    queue_depth,
+)
+from .resources import connect_redis, redis
+from .schemas.mail import Message
+
+CONSUMER = f'{socket.gethostname()}-{os.getpid()}'
+REPORT_INTERVAL = 60  # seconds
+
+Entry = tuple[bytes, dict[bytes, bytes]]  # stream entry id and fields
+
+# moves the messages whose retry time has come back into the stream
+_schedule_retries = redis.register_script(
+    """
+    local due = redis.call(
+        'ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2]
+    )
+    for _, item in ipairs(due) do
+        local retry = cjson.decode(item)
+        redis.call(
+            'XADD', KEYS[2], '*',
+            'message', retry['message'], 'attempts', retry['attempts']
+        )
+        redis.call('ZREM', KEYS[1], item)
+    end
+    return #due
+    """
+)
+
+
+class SMTPPool:
+    """
+    Persistent SMTP connections, opened on demand and reopened when needed
+    """
+
+    def __init__(
+        self,
+        hostname: str,
+        port: int,
+        size: int = 1,
+        start_tls: bool = False,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        suppress_send: bool = False,
+    ) -> None:
+        self.suppress_send = suppress_send
+        self._idle: asyncio.Queue[SMTP] = asyncio.Queue()
+        for _ in range(size):
+            self._idle.put_nowait(
+                SMTP(
+                    hostname=hostname,
+                    port=port,
+                    start_tls=start_tls,
+                    username=username,
+                    password=password,
+                )
+            )
+        self._connections = list(self._idle._queue)  # type: ignore
+
+    @classmethod
+    def from_config(cls) -> 'SMTPPool':
+        return cls(
+            config.MAIL_SERVER,
+            config.MAIL_PORT,
+            config.MAIL_WORKER_CONNECTIONS,
+            config.MAIL_STARTTLS,
+            config.MAIL_USERNAME,
+            config.MAIL_PASSWORD,
+            config.MAIL_SUPPRESS_SEND,
+        )
+
+    async def send(self, email: EmailMessage) -> None:
+        if self.suppress_send:
+            logger.debug(f'Suppressed email to {email["To"]}')
+            return
+        smtp = await self._idle.get()
+        try:
+            if not smtp.is_connected:
+                await smtp.connect()
+            try:
+                await smtp.send_message(email)
+            except SMTPServerDisconnected:  # idle connection closed by the server
+                await smtp.connect()
+                await smtp.send_message(email)
+        except BaseException:
+            smtp.close()  # it will be reopened by the next message
+            raise
+        finally:
+            self._idle.put_nowait(smtp)
+
+    async def close(self) -> None:
+        for smtp in self._connections:
+            if smtp.is_connected:
+                try:
+                    await smtp.quit()
+                except Exception:
+                    smtp.close()
+
+
+def build_email(message: Message) -> EmailMessage:
+    email = EmailMessage()
+    email['From'] = formataddr((config.MAIL_FROM_NAME, config.MAIL_FROM))
+    email['To'] = ', '.join(message.recipients)
+    email['Subject'] = message.subject
+    email.set_content(message.body)
+    if message.html:
+        email.add_alternative(message.html, subtype='html')
+    return email
+
+
+def retry_delay(attempts: int) -> float:
+    return config.MAIL_RETRY_DELAY * 2 ** (attempts - 1)
+
+
+async def create_group() -> None:
+    try:
+        await redis.xgroup_create(MAIL_STREAM, MAIL_GROUP, id='0', mkstream=True)
+    except ResponseError as error:
+        if 'BUSYGROUP' not in str(error):  # group already exists
+            raise
+
+
+async def schedule_retries() -> int:
+    return await _schedule_retries(
+        keys=[RETRY_QUEUE, MAIL_STREAM], args=[time(), config.MAIL_BATCH_SIZE]
+    )
+
+
+async def claim_stale_entries() -> list[Entry]:
+    """
+    Takes over the entries that other workers received but never acknowledged
+    """
+    response = await redis.execute_command(
+        'XAUTOCLAIM',
+        MAIL_STREAM,
+        MAIL_GROUP,
+        CONSUMER,
+        config.MAIL_CLAIM_IDLE_TIME * 1000,
+        '0-0',
+        'COUNT',
+        config.MAIL_BATCH_SIZE,
+    )
+    return [
+        (id, dict(zip(fields[::2], fields[1::2])))
+        for id, fields in response[1]
+        if fields  # deleted entries
+    ]
+
+
+async def read_entries(block: int) -> list[Entry]:
+    response = await redis.xreadgroup(
+        MAIL_GROUP,
+        CONSUMER,
+        {MAIL_STREAM: '>'},
+        count=config.MAIL_BATCH_SIZE,
+        block=block,
+    )
+    return response[0][1] if response else []
+
+
+async def deliver(pool: SMTPPool, fields: dict[bytes, bytes]) -> bool:
+    """
+    Sends the message or schedules its next attempt
+    """
+    try:
+        message = Message.parse_raw(fields[b'message'])
+        attempts = int(fields.get(b'attempts', 0)) + 1
+    except (KeyError, ValueError) as error:  # retrying won't help
+        logger.error(f'Unreadable mail entry moved to dead letters: {error!r}')
+        await redis.xadd(
+            DEAD_LETTER_STREAM,
+            {
+                'message': fields.get(b'message', b''),
+                'attempts': fields.get(b'attempts', b'0'),
+            },
+        )
+        return False
+    try:
+        await pool.send(build_email(message))
+        return True
+    except Exception as error:
+        logger.warning(
+            f'Attempt {attempts} to email {message.recipients} failed: {error!r}'
+        )
+    if attempts >= config.MAIL_MAX_ATTEMPTS:
+        await redis.xadd(
+            DEAD_LETTER_STREAM,
+            {'message': fields[b'message'], 'attempts': attempts},
+        )
+    else:
+        retry = {
+            'message': fields[b'message'].decode(),
+            'attempts': attempts,
+            'id': monotonic(),  # keeps retries of the same message apart
+        }
+        await redis.zadd(
+            RETRY_QUEUE, {json.dumps(retry): time() + retry_delay(attempts)}
+        )
+    return False
+
+
+async def process_batch(
+    pool: SMTPPool, entries: Optional[list[Entry]] = None, block: int = 5000
+) -> tuple[int, int]:
+    """
+    Delivers a batch of entries concurrently and acknowledges them.
+
+    An entry whose delivery raised (e.g. its retry couldn't be scheduled)
+    isn't acknowledged, so that it's claimed again after MAIL_CLAIM_IDLE_TIME.
+    Returns the number of messages sent and failed.
+    """
+    if entries is None:
+        entries = await read_entries(block)
+    if not entries:
+        return 0, 0
+    results = await asyncio.gather(
+        *(deliver(pool, fields) for _, fields in entries), return_exceptions=True
+    )
+    handled = []
+    sent = 0
+    for (id, _), result in zip(entries, results):
+        if isinstance(result, BaseException):
+            logger.error(f'Mail entry {id.decode()} left pending: {result!r}')
+            continue
+        handled.append(id)
+        sent += result
+    if handled:
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.xack(MAIL_STREAM, MAIL_GROUP, *handled)
+            pipe.xdel(MAIL_STREAM, *handled)
+            await pipe.execute()
+    return sent, len(results) - sent
+
+
+async def run() -> None:
+    setup_logger()
+    await connect_redis()
+    await create_group()
+    pool = SMTPPool.from_config()
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    logger.info(f'Mail worker {CONSUMER} started')
+    sent = failed = 0
+    last_report = last_claim = monotonic()
+    try:
+        while not stopping.is_set():
+            await schedule_retries()
+            entries = None
+            if monotonic() - last_claim > config.MAIL_CLAIM_IDLE_TIME / 2:
+                entries = await claim_stale_entries() or None
+                last_claim = monotonic()
+            batch_sent, batch_failed = await process_batch(pool, entries)
+            sent += batch_sent
+            failed += batch_failed
+
+            elapsed = monotonic() - last_report
+            if elapsed >= REPORT_INTERVAL:
+                logger.info(
+                    f'{sent / elapsed:.1f} emails/s. '
+                    f'sent: {sent}, failed: {failed}, '
+                    f'queued: {await queue_depth()}'
+                )
+                sent = failed = 0
+                last_report = monotonic()
+    finally:
+        await pool.close()
+        logger.info(f'Mail worker {CONSUMER} stopped')
+        flush_logger()
+
+
+if __name__ == '__main__':
+    asyncio.run(run())
@@ -1,26 +1,119 @@
+"""
+Emails are not sent by the app.
+They are enqueued into a Redis stream and sent by app.mail_worker.
+The stream only holds the messages waiting to be sent,
+which are never trimmed. When MAIL_QUEUE_MAXLEN of them are waiting,
+new messages are refused instead.
+
+Jinja is only imported and the templates only compiled
+when the first email is rendered, which keeps it out of the app startup.
+"""
+
 from pathlib import Path
+from typing import TYPE_CHECKING, Any, Optional
 
-from fastapi_mail import ConnectionConfig, FastMail
-from jinja2 import Environment, FileSystemLoader
+from loguru import logger
 
 from . import config
+from .resources import redis
+from .schemas.mail import Message
+from .tracing import span
 
-templates_path = Path(__file__).parent / 'templates'
-conf = ConnectionConfig(
-    MAIL_USERNAME=config.MAIL_USERNAME,
-    MAIL_PASSWORD=config.MAIL_PASSWORD,
-    MAIL_FROM=config.MAIL_FROM,
-    MAIL_PORT=config.DB_PORT,
-    MAIL_SERVER=config.MAIL_SERVER,
-    MAIL_FROM_NAME=config.MAIL_FROM_NAME,
-    MAIL_TLS=True,
-    MAIL_SSL=False,
-    USE_CREDENTIALS=True,
-    MAIL_DEBUG=config.DEBUG,
-    SUPPRESS_SEND=config.DEBUG or config.TESTING,
-    TEMPLATE_FOLDER=templates_path,
+MAIL_STREAM = 'mail:queue'
+MAIL_GROUP = 'mail_workers'
+RETRY_QUEUE = 'mail:retry'  # sorted set scored by the time of the next attempt
+DEAD_LETTER_STREAM = 'mail:dead'
+
+DEFAULT_LANGUAGE = 'en'
+
+if TYPE_CHECKING:
+    from jinja2 import Environment, Template
+
+# adds the message unless the queue is full. Returns its id or nil
+_enqueue = redis.register_script(
+    """
+    if redis.call('XLEN', KEYS[1]) >= tonumber(ARGV[1]) then
+        return false
+    end
+    return redis.call('XADD', KEYS[1], '*', 'message', ARGV[2], 'attempts', 0)
+    """
 )
 
-mailer = FastMail(conf)
-loader = FileSystemLoader(templates_path)
-templates = Environment(loader=loader, autoescape=True)
+
+class MailQueueFullError(Exception):
+    """
+    Raised when MAIL_QUEUE_MAXLEN messages are already waiting to be sent
+    """
+
+
+templates_path = Path(__file__).parent / 'templates'
+templates: Optional['Environment'] = None
+# (name, language, extension) -> template. e.g. reset_password.pt-br.html
+compiled: dict[tuple[str, str, str], 'Template'] = {}
+
+
+def environment() -> 'Environment':
+    global templates
+
+    if templates is None:
+        from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+        templates = Environment(
+            loader=FileSystemLoader(templates_path),
+            autoescape=True,
+            auto_reload=config.DEBUG,
+            # compiled templates are shared by workers and kept between restarts
+            bytecode_cache=FileSystemBytecodeCache(),
+        )
+    return templates
+
+
+def load_templates() -> None:
+    """
+    Compiles all templates at once, so that rendering doesn't touch the disk
+    """
+    env = environment()
+    for path in templates_path.glob('*.*.*'):
+        name, language, extension = path.name.split('.')
+        compiled[name, language, extension] = env.get_template(path.name)
+
+
+def render(name: str, language: str, **params: Any) -> tuple[str, str]:
+    """
+    Returns the text and HTML versions of an email.
+    Unknown languages fall back to DEFAULT_LANGUAGE.
+    """
+    if not compiled:
+        load_templates()
+    language = language.lower()
+    if (name, language, 'txt') not in compiled:
+        language = DEFAULT_LANGUAGE
+    result = []
+    for extension in ('txt', 'html'):
+        if config.DEBUG:  # reloads the template if it has changed
+            path = f'{name}.{language}.{extension}'
+            template = environment().get_template(path)
+        else:
+            template = compiled[name, language, extension]
+        result.append(template.render(params))
+    return result[0], result[1]
+
+
+async def enqueue_message(message: Message) -> None:
+    with span('mail enqueue'):
+        added = await _enqueue(
+            keys=[MAIL_STREAM], args=[config.MAIL_QUEUE_MAXLEN, message.json()]
+        )
+    if not added:
+        logger.warning(
+            f'Mail queue is full. Email to {message.recipients} refused'
+        )
+        raise MailQueueFullError()
+
+
+async def queue_depth() -> int:
+    """
+    Sent messages are deleted from the stream,
+    so its length is the number of messages waiting to be sent
+    """
+    return await redis.xlen(MAIL_STREAM)
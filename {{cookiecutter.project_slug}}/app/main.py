@@ -1,16 +1,22 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import ORJSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware
 
 from . import config
-from .middlewares import dispatch
+from .hashing import HashingOverloadedError
+from .mailer import MailQueueFullError
+from .middlewares import (
+    DBTransactionMiddleware,
+    HealthMiddleware,
+    MetricsMiddleware,
+)
 from .resources import shutdown, startup
-from .routers import confirmation, login, user
+from .routers import confirmation, login, metrics, user
 
 routers = [
     confirmation.router,
     login.router,
+    metrics.router,
     user.router,
 ]
 
@@ -33,12 +39,36 @@ app.add_middleware(
     expose_headers=['x-csrf-token'],
 )
 
-app.add_middleware(BaseHTTPMiddleware, dispatch=dispatch)
+app.add_middleware(DBTransactionMiddleware)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(HealthMiddleware)  # the outermost one
 
 for router in routers:
     app.include_router(router)
 
 
+@app.exception_handler(HashingOverloadedError)
+async def hashing_overloaded_handler(
+    request: Request, exc: HashingOverloadedError
+) -> ORJSONResponse:
+    return ORJSONResponse(
+        {'detail': 'Service Unavailable'},
+        status_code=503,
+        headers={'Retry-After': '1'},
+    )
+
+
+@app.exception_handler(MailQueueFullError)
+async def mail_queue_full_handler(
+    request: Request, exc: MailQueueFullError
+) -> ORJSONResponse:
+    return ORJSONResponse(
+        {'detail': 'Service Unavailable'},
+        status_code=503,
+        headers={'Retry-After': '60'},
+    )
+
+
 @app.on_event('startup')
 async def startup_event():
     await startup()
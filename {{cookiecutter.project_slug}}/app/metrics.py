@@ -0,0 +1,91 @@
+"""
+Prometheus metrics.
+
+When hypercorn runs several workers, PROMETHEUS_MULTIPROC_DIR must point to
+an empty directory, created before the workers start,
+so that /metrics aggregates the metrics of all of them.
+See https://github.com/prometheus/client_python#multiprocess-mode-eg-gunicorn
+"""
+
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+MULTIPROCESS = 'PROMETHEUS_MULTIPROC_DIR' in os.environ
+
+REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds',
+    'HTTP request latency by route template',
+    ['method', 'route', 'status'],
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    'http_requests_in_progress',
+    'HTTP requests being processed',
+    multiprocess_mode='livesum',
+)
+DB_QUERY_DURATION = Histogram(
+    'db_query_duration_seconds', 'Database query latency', ['operation']
+)
+DB_POOL_CONNECTIONS = Gauge(
+    'db_pool_connections',
+    'Database pool connections by state',
+    ['state'],
+    multiprocess_mode='livesum',
+)
+REDIS_COMMAND_DURATION = Histogram(
+    'redis_command_duration_seconds', 'Redis command latency', ['command']
+)
+USER_CACHE_REQUESTS = Counter(
+    'user_cache_requests',
+    'User cache lookups by cache layer and result',
+    ['layer', 'result'],
+)
+EMAIL_QUEUE_DEPTH = Gauge(
+    'email_queue_depth',
+    'Emails waiting to be sent',
+    multiprocess_mode='mostrecent',
+)
+PASSWORD_HASH_QUEUE_WAIT = Histogram(
+    'password_hash_queue_wait_seconds', 'Time waiting for a hashing worker'
+)
+PASSWORD_HASH_DURATION = Histogram(
+    'password_hash_duration_seconds', 'Time hashing or verifying a password'
+)
+PASSWORD_HASH_REJECTED = Counter(
+    'password_hash_rejected', 'Hashes rejected because the queue was full'
+)
+LOG_MESSAGES_DROPPED = Counter(
+    'log_messages_dropped', 'Log messages dropped because the queue was full'
+)
+TRACE_SPANS_DROPPED = Counter(
+    'trace_spans_dropped', 'Trace spans dropped because the queue was full'
+)
+
+
+def latest() -> tuple[bytes, str]:
+    """
+    Returns the current metrics in Prometheus text format and its content type
+    """
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead() -> None:
+    """
+    Removes the live gauges of the current worker
+    """
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
@@ -1,21 +1,234 @@
-from fastapi import Request, Response
+from time import perf_counter
+from typing import Callable, Optional
 
-from .resources import db
+from loguru import logger
+from starlette.datastructures import MutableHeaders
+from starlette.requests import HTTPConnection
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+from . import config, resources, tracing
+from .database import RequestTransaction, request_transaction
+from .log import RequestLog, request_log
+from .metrics import REQUEST_DURATION, REQUESTS_IN_PROGRESS
+from .resources import db, replicas
 
-async def _dispatch(request: Request, call_next) -> Response:
+READONLY_METHODS = ('GET', 'HEAD')
+# signals that the client wrote recently and must read from the primary
+READ_YOUR_WRITES_COOKIE = 'read_your_writes'
+
+
+class DBTransactionMiddleware:
+    """
+    Wraps all routes within a DB transaction.
+
+    The transaction is only started by the first query of the request
+    (see app.database) and it is read-only for GET and HEAD requests.
+    When there are read replicas, clients that write something
+    get a short-lived cookie that keeps their reads on the primary.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        await _dispatch(self.app, scope, receive, send)
+
+
+async def _dispatch(app: ASGIApp, scope: Scope, receive: Receive, send: Send):
+    """
+    Commits the transaction if the app succeeds or rolls it back otherwise.
+
+    The response start and its last body message are held until the
+    transaction is committed, so that clients never see uncommitted data
+    and a failed commit can still become a 500 error.
+
+    This indirection also makes it possible to mock the middleware in tests.
+    """
+    readonly = scope['method'] in READONLY_METHODS
+    transaction = RequestTransaction(db, readonly)
+    if replicas.databases:
+        cookies = HTTPConnection(scope).cookies
+        transaction.read_your_writes = READ_YOUR_WRITES_COOKIE in cookies
+    held: list[Message] = []
+
+    async def _send(message: Message) -> None:
+        if message.get('more_body', False):  # chunk of a streaming response
+            for held_message in held:
+                await send(held_message)
+            held.clear()
+            await send(message)
+        else:
+            held.append(message)
+
+    token = request_transaction.set(transaction)
+    try:
+        await app(scope, receive, _send)
+    except BaseException:
+        await transaction.finish(commit=False)
+        raise
+    else:
+        await transaction.finish(commit=True)
+    finally:
+        request_transaction.reset(token)
+    for message in held:
+        if (
+            message['type'] == 'http.response.start'
+            and transaction.wrote
+            and replicas.databases
+        ):
+            MutableHeaders(scope=message).append(
+                'set-cookie',
+                f'{READ_YOUR_WRITES_COOKIE}=1; '
+                f'Max-Age={config.READ_YOUR_WRITES_WINDOW}; '
+                'Path=/; HttpOnly; Secure; SameSite=lax',
+            )
+        await send(message)
+
+
+class HealthMiddleware:
     """
-    Wraps all routes within a DB transaction
+    Answers the liveness (/healthz) and readiness (/readyz) probes
+    ahead of the other middlewares and the router.
+
+    /readyz returns the last result of the background health check
+    (see app.health) and 503 until the startup is finished
+    or while a dependency is down.
     """
-    async with db.connection() as conn:  # uses the current connection
-        async with conn.transaction():
-            return await call_next(request)
+
+    headers = [
+        (b'content-type', b'application/json'),
+        (b'cache-control', b'no-store'),
+    ]
+    alive = b'{"status":"ok"}'
+    starting = b'{"status":"starting"}'
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        path = scope.get('path')
+        if scope['type'] != 'http' or path not in ('/healthz', '/readyz'):
+            await self.app(scope, receive, send)
+            return
+        status, body = 200, self.alive
+        if path == '/readyz':
+            if not resources.ready:
+                status, body = 503, self.starting
+            else:
+                health = resources.health
+                status, body = (200 if health.healthy else 503), health.body
+        await send(
+            {
+                'type': 'http.response.start',
+                'status': status,
+                'headers': self.headers,
+            }
+        )
+        await send({'type': 'http.response.body', 'body': body})
+
+
+def header(scope: Scope, name: bytes) -> Optional[str]:
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return None
 
 
-async def dispatch(request: Request, call_next) -> Response:
+class MetricsMiddleware:
     """
-    The way BaseHTTPMiddleware works, using self.dispatch_func indirection,
-    makes it very difficult to mock this function,
-    but it is possible to include another indirection and mock that one instead.
+    Measures the latency of each request by route template (e.g. /users/{id})
+    and the number of requests in progress.
+
+    It also writes the access log, decides whether the debug messages
+    of the request are logged (see app.log) and starts the root span
+    of sampled requests (see app.tracing).
     """
-    return await _dispatch(request, call_next)
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self._routes: dict[Callable, str] = {}  # endpoint -> route path
+
+    def route_path(self, scope: Scope) -> str:
+        """
+        The router stores the endpoint of the matched route in the scope
+        """
+        endpoint: Optional[Callable] = scope.get('endpoint')
+        if endpoint is None:
+            return 'unmatched'
+        if endpoint not in self._routes:
+            self._routes[endpoint] = next(
+                (
+                    route.path
+                    for route in scope['app'].routes
+                    if getattr(route, 'endpoint', None) is endpoint
+                ),
+                'unmatched',
+            )
+        return self._routes[endpoint]
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def _send(message: Message) -> None:
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        trace = None
+        if tracing.exporter is not None:
+            trace = tracing.start_trace(
+                scope['method'], header(scope, b'traceparent')
+            )
+        error: Optional[BaseException] = None
+        # the router sets the endpoint of the matched route
+        log = RequestLog(
+            lambda: self.route_path(scope) if 'endpoint' in scope else None
+        )
+        token = request_log.set(log)
+        REQUESTS_IN_PROGRESS.inc()
+        start = perf_counter()
+        try:
+            await self.app(scope, receive, _send)
+        except BaseException as exc:
+            error = exc
+            raise
+        finally:
+            elapsed = perf_counter() - start
+            REQUESTS_IN_PROGRESS.dec()
+            route = self.route_path(scope)
+            REQUEST_DURATION.labels(scope['method'], route, status).observe(
+                elapsed
+            )
+            if trace is not None:
+                root = trace[0]
+                root.name = f'{scope["method"]} {route}'
+                root.attributes.update(
+                    {
+                        'http.method': scope['method'],
+                        'http.route': route,
+                        'http.target': scope['path'],
+                        'http.status_code': status,
+                    }
+                )
+                if status >= 500 and error is None:
+                    root.error = f'HTTP {status}'
+                tracing.end_trace(trace, error)
+            if config.ACCESS_LOG and (status >= 500 or log.decide(route)):
+                logger.info(
+                    '{method} {path} {status} {duration:.1f}ms',
+                    method=scope['method'],
+                    path=scope['path'],
+                    route=route,
+                    status=status,
+                    duration=elapsed * 1000,
+                    client=(scope.get('client') or ('',))[0],
+                )
+            request_log.reset(token)
@@ -0,0 +1,123 @@
+"""
+Versioned schema migrations.
+
+Migrations are SQL scripts in app/migrations, named <version>_<description>.sql
+and applied in version order. Applied versions are recorded in the
+schema_version table.
+
+Every worker calls migrate() at startup. When the schema is up to date,
+which is the common case, it costs a single query. Otherwise, the scripts
+run in one transaction under a Postgres advisory lock, so only one worker
+migrates while the others wait and then find nothing left to do.
+
+Command line::
+
+    python -m app.migrate
+"""
+
+import asyncio
+from pathlib import Path
+from typing import NamedTuple
+
+from asyncpg.exceptions import UndefinedTableError
+from loguru import logger
+
+from .database import Database
+
+MIGRATIONS_DIR = Path(__file__).parent / 'migrations'
+MIGRATION_LOCK = 0x6D696772617465  # advisory lock id: b'migrate'
+CREATE_VERSION_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    name VARCHAR NOT NULL,
+    applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+)
+"""
+SELECT_VERSION = 'SELECT coalesce(max(version), 0) FROM schema_version'
+INSERT_VERSION = 'INSERT INTO schema_version (version, name) VALUES ($1, $2)'
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    path: Path
+
+
+def load_migrations(directory: Path = MIGRATIONS_DIR) -> list[Migration]:
+    migrations = []
+    for path in directory.glob('*.sql'):
+        version, _, name = path.stem.partition('_')
+        if not version.isdigit():
+            raise ValueError(f'Migration without version: {path}')
+        migrations.append(Migration(int(version), name, path))
+    migrations.sort()
+    versions = [migration.version for migration in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError(f'Duplicate migration versions in {directory}')
+    return migrations
+
+
+async def schema_version(database: Database) -> int:
+    try:
+        return await database.fetch_val(SELECT_VERSION)
+    except UndefinedTableError:  # nothing was migrated yet
+        return 0
+
+
+async def migrate(
+    database: Database, directory: Path = MIGRATIONS_DIR
+) -> list[int]:
+    """
+    Applies the pending migrations and returns their versions
+    """
+    migrations = load_migrations(directory)
+    if not migrations or await schema_version(database) >= migrations[-1].version:
+        return []
+
+    applied = []
+    async with database.connection() as connection:
+        async with connection.transaction():
+            raw_connection = connection.raw_connection
+            async with connection._query_lock:  # as databases' own queries
+                # held until the end of the transaction
+                await raw_connection.execute(
+                    'SELECT pg_advisory_xact_lock($1)', MIGRATION_LOCK
+                )
+                await raw_connection.execute(CREATE_VERSION_TABLE)
+                # another worker might have migrated while we waited
+                version = await raw_connection.fetchval(SELECT_VERSION)
+                for migration in migrations:
+                    if migration.version <= version:
+                        continue
+                    logger.info(
+                        'Applying migration {} {}',
+                        migration.version,
+                        migration.name,
+                    )
+                    # the simple query protocol runs multiple statements
+                    await raw_connection.execute(migration.path.read_text())
+                    await raw_connection.execute(
+                        INSERT_VERSION, migration.version, migration.name
+                    )
+                    applied.append(migration.version)
+    return applied
+
+
+async def main() -> None:
+    from . import config
+    from .log import flush_logger, setup_logger
+    from .resources import connect_database
+
+    setup_logger()
+    database = Database(config.DATABASE_URL)
+    await connect_database(database)
+    try:
+        applied = await migrate(database)
+    finally:
+        await database.disconnect()
+    logger.info('Applied migrations: {}', applied or 'none')
+    flush_logger()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,9 @@
+-- also matches databases created by metadata.create_all before migrations
+CREATE TABLE IF NOT EXISTS "user" (
+    id INTEGER NOT NULL,
+    name VARCHAR NOT NULL,
+    email VARCHAR NOT NULL,
+    password_hash VARCHAR(77) NOT NULL,
+    PRIMARY KEY (id),
+    UNIQUE (email)
+);
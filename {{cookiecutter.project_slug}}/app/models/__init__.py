@@ -4,7 +4,7 @@ from sqlalchemy import MetaData
 
 metadata = MetaData()
 
-MAX_ID = 2 ** 31
+MAX_ID = 2**31
 
 
 def random_id() -> int:
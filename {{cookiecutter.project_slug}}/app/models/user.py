@@ -1,16 +1,43 @@
-from typing import Optional
+import asyncio
+from functools import partial
+from hashlib import blake2b
+from time import time
+from typing import Any, AsyncIterator, Mapping, Optional
 
 import orjson as json
 from loguru import logger
-from passlib.context import CryptContext
-from sqlalchemy import Column, Integer, String, Table, Unicode
+from sqlalchemy import (
+    Column,
+    Integer,
+    String,
+    Table,
+    Unicode,
+    any_,
+    bindparam,
+    func,
+    select,
+)
+from sqlalchemy.sql import Select
 
 from .. import config
-from ..resources import db, redis
+from ..cache import LocalCache
+from ..database import Statement, after_commit
+from ..hashing import hash_password, verify_password
+from ..metrics import USER_CACHE_REQUESTS
+from ..resources import db, redis, replicas
 from ..schemas.user import UserInfo, UserInsert, UserPatch
+from ..sessions import touch_session
 from . import metadata, random_id
 
-crypt_ctx = CryptContext(schemes=['argon2'])
+# L1 cache in front of the user records cached in Redis
+user_cache = LocalCache('users', config.USER_CACHE_SIZE, config.USER_CACHE_TTL)
+local_cache_hits = USER_CACHE_REQUESTS.labels('local', 'hit')
+local_cache_misses = USER_CACHE_REQUESTS.labels('local', 'miss')
+redis_cache_hits = USER_CACHE_REQUESTS.labels('redis', 'hit')
+redis_cache_misses = USER_CACHE_REQUESTS.labels('redis', 'miss')
+# sorted set of the ids of the users cached in Redis, scored by the time
+# they were cached. Only kept when config.USER_PRELOAD_SIZE > 0
+RECENT_USERS = 'users:recent'
 
 
 User = Table(
@@ -27,58 +54,255 @@ User = Table(
     Column('password_hash', String(77), nullable=False),
 )
 
+# queries compiled once. See app.database.Statement
+select_all = Statement('user.select_all', User.select())
+select_by_id = Statement(
+    'user.select_by_id', User.select(User.c.id == bindparam('id'))
+)
+select_by_email = Statement(
+    'user.select_by_email', User.select(User.c.email == bindparam('email'))
+)
+select_by_ids = Statement(
+    'user.select_by_ids', User.select(User.c.id == any_(bindparam('ids')))
+)
+insert_user = Statement(
+    'user.insert',
+    User.insert().values({column: bindparam(column) for column in User.c.keys()}),
+)
+delete_by_id = Statement(
+    'user.delete_by_id', User.delete().where(User.c.id == bindparam('id'))
+)
+
 
 async def get_all() -> list[UserInfo]:
-    query = User.select()
-    logger.debug(query)
-    result = await db.fetch_all(query)
+    logger.debug(select_all)
+    result = await replicas.fetch_all(db, select_all)
     return [UserInfo(**r) for r in result]
 
 
-async def get_user_by_email(email: str) -> Optional[UserInfo]:
-    query = User.select(User.c.email == email)
+def _select_users(
+    after: Optional[int], name: Optional[str], email: Optional[str]
+) -> Select:
+    """
+    Users ordered by id, starting after the id ``after`` (keyset pagination),
+    so that every page costs the same index scan, however deep it is
+    """
+    query = select(User.c.id, User.c.name, User.c.email).order_by(User.c.id)
+    if after is not None:
+        query = query.where(User.c.id > after)
+    if name:
+        query = query.where(
+            func.lower(User.c.name, type_=Unicode).contains(
+                name.lower(), autoescape=True
+            )
+        )
+    if email:
+        query = query.where(
+            func.lower(User.c.email, type_=Unicode).startswith(
+                email.lower(), autoescape=True
+            )
+        )
+    return query
+
+
+async def list_users(
+    limit: int,
+    after: Optional[int] = None,
+    name: Optional[str] = None,
+    email: Optional[str] = None,
+) -> list[Mapping[str, Any]]:
+    """
+    Page of users whose name contains ``name`` and email starts with ``email``
+    """
+    query = _select_users(after, name, email).limit(limit)
+    logger.debug(query)
+    return await replicas.fetch_all(db, query)
+
+
+async def iterate_users(
+    after: Optional[int] = None,
+    name: Optional[str] = None,
+    email: Optional[str] = None,
+) -> AsyncIterator[Mapping[str, Any]]:
+    """
+    Same as list_users, but without limit.
+    Records are fetched through a cursor, so only a few are kept in memory
+    """
+    query = _select_users(after, name, email)
     logger.debug(query)
-    result = await db.fetch_one(query)
+    async for record in db.iterate(query):
+        yield record
+
+
+async def get_user_by_email(email: str) -> Optional[UserInfo]:
+    logger.debug(select_by_email)
+    result = await replicas.fetch_one(db, select_by_email, {'email': email})
     return UserInfo(**result) if result else None
 
 
 async def get_user_by_login(email: str, password: str) -> Optional[UserInfo]:
-    query = User.select(User.c.email == email)
-    logger.debug(query)
-    result = await db.fetch_one(query)
-    if result and crypt_ctx.verify(password, result['password_hash']):
+    logger.debug(select_by_email)
+    result = await replicas.fetch_one(db, select_by_email, {'email': email})
+    if result and await verify_password(password, result['password_hash']):
         return UserInfo(**result)
     return None
 
 
-async def get_user(id: int) -> Optional[UserInfo]:
+async def get_user(
+    id: int, session_id: Optional[str] = None
+) -> Optional[UserInfo]:
+    """
+    Searches the user in the local cache, Redis and then the database.
+
+    If ``session_id`` is given, the user is only returned if the session exists.
+    The session check and the Redis lookup share the same round trip.
+    """
+    if replicas.read_your_writes():  # the caches might be older than its writes
+        if session_id and await touch_session(session_id) is None:
+            return None
+        return await fetch_user(id, user_cache.generation)
+
+    user: Optional[UserInfo] = user_cache.get(id)
+    if user:
+        local_cache_hits.inc()
+        if session_id and await touch_session(session_id) is None:
+            return None
+        return user
+    local_cache_misses.inc()
+    generation = user_cache.generation
+
     user_id = f'user:{id}'
     # search on Redis first
-    result = await redis.get(user_id)
+    if session_id:
+        values = await touch_session(session_id, user_id)
+        if values is None:
+            return None
+        result = values[0]
+    else:
+        result = await redis.get(user_id)
     if result:
-        logger.debug(f'user {id} is cached')
-        return UserInfo(**json.loads(result))
-
-    # search in the database
-    logger.debug(f'user {id} not cached')
-    query = User.select(User.c.id == id)
-    logger.debug(query)
-    result = await db.fetch_one(query)
-    if result:
-        user = UserInfo(**result)
-        await redis.set(user_id, user.json(), ex=config.SESSION_LIFETIME)
+        redis_cache_hits.inc()
+        logger.debug('user {} is cached', id)
+        user = trusted_user(result)
+        user_cache.set(id, user, generation)
         return user
-    return None
+
+    redis_cache_misses.inc()
+    logger.debug('user {} not cached', id)
+    return await fetch_user(id, generation)
+
+
+async def fetch_user(id: int, generation: int) -> Optional[UserInfo]:
+    """
+    Searches the user in the database and caches it
+    """
+    logger.debug(select_by_id)
+    result, from_replica = await replicas.read(
+        db, 'fetch_one', select_by_id, {'id': id}
+    )
+    if not result:
+        return None
+    user = UserInfo(**result)
+    await cache_user(user, from_replica)
+    user_cache.set(id, user, generation)
+    return user
+
+
+async def cache_user(user: UserInfo, from_replica: bool = False) -> None:
+    """
+    Stores the user in Redis so that the next lookups skip the database
+    """
+    # replicas might lag behind, so their records are cached for a short time
+    if from_replica:
+        ttl = config.REPLICA_CACHE_TTL
+    else:
+        ttl = config.USER_REDIS_CACHE_TTL
+    if not config.USER_PRELOAD_SIZE:
+        await redis.set(f'user:{user.id}', serialize(user), ex=ttl)
+        return
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.set(f'user:{user.id}', serialize(user), ex=ttl)
+        pipe.zadd(RECENT_USERS, {str(user.id): time()})
+        pipe.zremrangebyrank(RECENT_USERS, 0, -config.USER_PRELOAD_SIZE - 1)
+        await pipe.execute()
+
+
+async def preload_users() -> int:
+    """
+    Loads the most recently cached users into the local cache,
+    so that a new worker doesn't start with a cold cache.
+    Users no longer in Redis are fetched from the database in one query.
+
+    Returns the number of users loaded
+    """
+    if not (config.USER_PRELOAD_SIZE and config.USER_CACHE_SIZE):
+        return 0
+    ids = [
+        int(id)
+        for id in await redis.zrevrange(
+            RECENT_USERS, 0, config.USER_PRELOAD_SIZE - 1
+        )
+    ]
+    if not ids:
+        return 0
+    generation = user_cache.generation
+    values = await redis.mget([f'user:{id}' for id in ids])
+    missing = []
+    for id, value in zip(ids, values):
+        if value:
+            user_cache.set(id, trusted_user(value), generation)
+        else:
+            missing.append(id)
+    loaded = len(ids) - len(missing)
+    if missing:
+        logger.debug(select_by_ids)
+        records = await db.fetch_all(select_by_ids, {'ids': missing})
+        users = [UserInfo(**record) for record in records]
+        await asyncio.gather(*(cache_user(user) for user in users))
+        for user in users:
+            user_cache.set(user.id, user, generation)
+        loaded += len(users)
+    return loaded
+
+
+def serialize(user: UserInfo) -> bytes:
+    """
+    JSON of the user. It is computed only once per instance
+    """
+    if user._json is None:
+        user._json = json.dumps(user.dict())
+    return user._json
+
+
+def etag(user: UserInfo) -> str:
+    """
+    Strong ETag of the serialized user. It is computed only once per instance.
+
+    Any change to the record changes the serialized user cached in Redis,
+    and so its ETag.
+    """
+    if user._etag is None:
+        digest = blake2b(serialize(user), digest_size=16).hexdigest()
+        user._etag = f'"{digest}"'
+    return user._etag
+
+
+def trusted_user(data: bytes) -> UserInfo:
+    """
+    Rebuilds a user serialized by this module without validating it again
+    """
+    user = UserInfo.construct(**json.loads(data))
+    user._json = data
+    return user
 
 
 async def insert(user: UserInsert) -> int:
     fields = user.dict()
     id_ = fields['id'] = random_id()
     password = fields.pop('password')
-    fields['password_hash'] = crypt_ctx.hash(password)
-    stmt = User.insert().values(fields)
-    logger.debug(stmt)
-    await db.execute(stmt)
+    fields['password_hash'] = await hash_password(password)
+    logger.debug(insert_user)
+    await db.execute(insert_user, fields)
     return id_
 
 
@@ -86,15 +310,19 @@ async def update(id: int, patch: UserPatch) -> None:
     fields = patch.dict(exclude_unset=True)
     if 'password' in fields:
         password = fields.pop('password')
-        fields['password_hash'] = crypt_ctx.hash(password)
+        fields['password_hash'] = await hash_password(password)
     stmt = User.update().where(User.c.id == id).values(**fields)
     logger.debug(stmt)
     await db.execute(stmt)
-    await redis.delete(f'user:{id}')  # invalidate cache
+    await after_commit(partial(uncache_user, id))
 
 
 async def delete(id: int) -> None:
-    stmt = User.delete().where(User.c.id == id)
-    logger.debug(stmt)
-    await db.execute(stmt)
+    logger.debug(delete_by_id)
+    await db.execute(delete_by_id, {'id': id})
+    await after_commit(partial(uncache_user, id))
+
+
+async def uncache_user(id: int) -> None:
     await redis.delete(f'user:{id}')
+    await user_cache.invalidate(redis, id)
@@ -0,0 +1,162 @@
+"""
+Rate limiting backed by Redis.
+
+Each strategy is an atomic Lua script that registers a hit and returns,
+in a single round trip, how many milliseconds the client must wait
+(0 means the hit was allowed).
+"""
+
+from ipaddress import ip_address
+from math import ceil
+from secrets import token_hex
+from typing import Callable, Optional, Union
+
+from fastapi import HTTPException, Request
+
+from . import config
+from .resources import redis
+
+KeyFunc = Callable[[Request], Optional[str]]
+
+_fixed_window = redis.register_script(
+    """
+    local count = redis.call('INCR', KEYS[1])
+    local ttl = redis.call('PTTL', KEYS[1])
+    if ttl < 0 then
+        ttl = tonumber(ARGV[2])
+        redis.call('PEXPIRE', KEYS[1], ttl)
+    end
+    if count > tonumber(ARGV[1]) then
+        return ttl
+    end
+    return 0
+    """
+)
+
+_sliding_window = redis.register_script(
+    """
+    local limit = tonumber(ARGV[1])
+    local window = tonumber(ARGV[2])
+    local now = redis.call('TIME')
+    local now_ms = now[1] * 1000 + math.floor(now[2] / 1000)
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now_ms - window)
+    if redis.call('ZCARD', KEYS[1]) < limit then
+        redis.call('ZADD', KEYS[1], now_ms, ARGV[3])
+        redis.call('PEXPIRE', KEYS[1], window)
+        return 0
+    end
+    local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    return math.max(1, oldest[2] + window - now_ms)
+    """
+)
+
+_token_bucket = redis.register_script(
+    """
+    local capacity = tonumber(ARGV[1])
+    local period = tonumber(ARGV[2])
+    local rate = capacity / period
+    local now = redis.call('TIME')
+    local now_ms = now[1] * 1000 + math.floor(now[2] / 1000)
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now_ms
+    tokens = math.min(capacity, tokens + (now_ms - ts) * rate)
+    local wait = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+    else
+        wait = math.ceil((1 - tokens) / rate)
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now_ms)
+    redis.call('PEXPIRE', KEYS[1], period)
+    return wait
+    """
+)
+
+STRATEGIES = ('fixed_window', 'sliding_window', 'token_bucket')
+
+
+async def hit(
+    key: str, limit: int, period: int, strategy: str = 'fixed_window'
+) -> int:
+    """
+    Registers a hit on ``key``, which accepts ``limit`` hits per ``period``
+    seconds.
+
+    Returns 0 if the hit is allowed or the number of seconds to wait otherwise.
+    """
+    keys = [f'ratelimit:{strategy}:{key}']
+    args: list[Union[int, str]] = [limit, period * 1000]
+    if strategy == 'fixed_window':
+        wait = await _fixed_window(keys=keys, args=args)
+    elif strategy == 'sliding_window':
+        wait = await _sliding_window(keys=keys, args=args + [token_hex(8)])
+    elif strategy == 'token_bucket':
+        wait = await _token_bucket(keys=keys, args=args)
+    else:
+        raise ValueError(f'Invalid rate limit strategy: {strategy}')
+    return ceil(wait / 1000)
+
+
+def client_ip(request: Request) -> Optional[str]:
+    """
+    The address of the client.
+
+    Requests that come through the proxies in config.TRUSTED_PROXIES
+    are attributed to the last address of X-Forwarded-For
+    that isn't a trusted proxy. The header can't be spoofed that way
+    """
+    if not request.client:
+        return None
+    address = request.client.host
+    forwarded = request.headers.get('x-forwarded-for', '').split(',')
+    hops = [hop.strip() for hop in forwarded if hop.strip()]
+    while hops and _trusted_proxy(address):
+        address = hops.pop()
+    return address
+
+
+def _trusted_proxy(address: str) -> bool:
+    try:
+        ip = ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in config.TRUSTED_PROXIES)
+
+
+def query_param(name: str) -> KeyFunc:
+    def key(request: Request) -> Optional[str]:
+        value = request.query_params.get(name)
+        return value.lower() if value else None
+
+    return key
+
+
+def rate_limit(
+    name: str,
+    limit: int,
+    period: int,
+    key: KeyFunc = client_ip,
+    strategy: str = 'fixed_window',
+) -> Callable:
+    """
+    Creates a FastAPI dependency that limits the requests
+    identified by ``key`` to ``limit`` per ``period`` seconds.
+    Exceeding requests get a 429 response with a Retry-After header.
+
+    Example::
+
+        @router.get('/', dependencies=[Depends(rate_limit('ip', 10, 60))])
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f'Invalid rate limit strategy: {strategy}')
+
+    async def dependency(request: Request) -> None:
+        value = key(request)
+        if not value:
+            return
+        wait = await hit(f'{name}:{value}', limit, period, strategy)
+        if wait:
+            raise HTTPException(429, headers={'Retry-After': str(wait)})
+
+    return dependency
@@ -1,71 +1,134 @@
 import asyncio
-import sys
 from string import ascii_uppercase
+from time import perf_counter
+from typing import Any
 
-from aioredis import Redis
-from databases import Database
+from aioredis import BlockingConnectionPool, Redis
+from aioredis.client import Pipeline
 from loguru import logger
 from tenacity import RetryError, retry, stop_after_delay, wait_exponential
 
-from . import config
+from . import config, hashing
+from .cache import clear_caches, listen_invalidations
+from .database import Database, Replicas, prime_connection
+from .health import HealthChecker
+from .log import flush_logger, setup_logger
+from .metrics import REDIS_COMMAND_DURATION, mark_process_dead
+from .migrate import migrate
+from .signed_sessions import denylist
+from .tracing import CLIENT, flush_tracing, setup_tracing, span
+
+
+class InstrumentedPipeline(Pipeline):
+    async def execute(self, raise_on_error: bool = True) -> list[Any]:
+        with span('redis PIPELINE', CLIENT) as current:
+            if current is not None:
+                current.attributes['db.system'] = 'redis'
+                current.attributes['db.statement'] = ' '.join(
+                    str(args[0]) for args, _ in self.command_stack
+                )
+            start = perf_counter()
+            try:
+                return await super().execute(raise_on_error)
+            finally:
+                REDIS_COMMAND_DURATION.labels('PIPELINE').observe(
+                    perf_counter() - start
+                )
+
+
+class InstrumentedRedis(Redis):
+    """
+    Redis client that measures the latency of each command
+    and traces it
+    """
 
-db = Database(config.DATABASE_URL)
-redis = Redis.from_url(config.REDIS_URL)
+    async def execute_command(self, *args: Any, **options: Any) -> Any:
+        with span('redis', CLIENT) as current:
+            if current is not None:
+                current.name = f'redis {args[0]}'
+                current.attributes['db.system'] = 'redis'
+            start = perf_counter()
+            try:
+                return await super().execute_command(*args, **options)
+            finally:
+                REDIS_COMMAND_DURATION.labels(args[0]).observe(
+                    perf_counter() - start
+                )
+
+    def pipeline(self, transaction: bool = True, shard_hint: Any = None):
+        return InstrumentedPipeline(
+            self.connection_pool, self.response_callbacks, transaction, shard_hint
+        )
+
+
+pool_options: dict[str, Any] = {
+    'min_size': config.DB_POOL_MIN_SIZE,
+    'max_size': config.DB_POOL_MAX_SIZE,
+    'init': prime_connection,
+}
+db = Database(config.DATABASE_URL, **pool_options)
+replicas = Replicas(
+    config.DATABASE_REPLICA_URLS, config.REPLICA_EJECTION_TIME, **pool_options
+)
+# requests wait for a free connection instead of failing when the pool is full
+redis = InstrumentedRedis(
+    connection_pool=BlockingConnectionPool.from_url(
+        config.REDIS_URL,
+        max_connections=config.REDIS_POOL_MAX_SIZE,
+        timeout=config.REDIS_POOL_TIMEOUT,
+    )
+)
+background_tasks: set[asyncio.Task] = set()
+# set once the startup, including the warm-up, is finished
+ready = False
+health = HealthChecker(
+    {'postgres': lambda: db.fetch_val('SELECT 1'), 'redis': redis.ping},
+    config.HEALTH_CHECK_INTERVAL,
+    config.HEALTH_CHECK_TIMEOUT,
+)
 
 
 async def startup():
+    global ready
+
     setup_logger()
+    setup_tracing()
     show_config()
-    await asyncio.gather(connect_redis(), start_database())
+    await asyncio.gather(connect_redis(), start_database(), replicas.connect())
+    subscribed = asyncio.Event()
+    background_tasks.add(
+        asyncio.create_task(listen_invalidations(redis, subscribed))
+    )
+    await asyncio.wait_for(subscribed.wait(), 3)
+    await log_connection_budget()
+    if config.SESSION_BACKEND == 'signed':
+        await denylist.refresh(redis)
+        background_tasks.add(asyncio.create_task(denylist.keep_updated(redis)))
+    await warm_up()
+    await health.check()
+    background_tasks.add(asyncio.create_task(health.keep_checking()))
+    ready = True
     logger.info('started...')
 
 
 async def shutdown():
-    await asyncio.gather(disconnect_redis(), db.disconnect())
+    global ready
+
+    ready = False
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    clear_caches()
+    denylist.entries.clear()
+    await asyncio.gather(
+        disconnect_redis(), db.disconnect(), replicas.disconnect()
+    )
+    hashing.pool.shutdown()
+    mark_process_dead()
     logger.info('...shutdown')
-
-
-def setup_logger():
-    """
-    Configure Loguru's logger
-    """
-    _intercept_standard_logging_messages()
-    logger.remove()  # remove standard handler
-    logger.add(
-        sys.stderr,
-        level=config.LOG_LEVEL,
-        colorize=True,
-        backtrace=config.DEBUG,
-        enqueue=True,
-    )  # reinsert it to make it run in a different thread
-
-
-def _intercept_standard_logging_messages():
-    """
-    Intercept standard logging messages toward loguru's logger
-    ref: loguru README
-    """
-    import logging
-
-    class InterceptHandler(logging.Handler):
-        def emit(self, record):
-            # Get corresponding Loguru level if it exists
-            try:
-                level = logger.level(record.levelname).name
-            except ValueError:
-                level = record.levelno
-
-            # Find caller from where originated the logged message
-            frame, depth = logging.currentframe(), 2
-            while frame.f_code.co_filename == logging.__file__:
-                frame = frame.f_back
-                depth += 1
-
-            logger.opt(depth=depth, exception=record.exc_info).log(
-                level, record.getMessage()
-            )
-
-    logging.basicConfig(handlers=[InterceptHandler()], level=0)
+    flush_tracing()
+    flush_logger()
 
 
 def show_config() -> None:
@@ -78,6 +141,58 @@ def show_config() -> None:
     return
 
 
+async def warm_up() -> None:
+    """
+    Opens connections and fills caches before the first requests arrive.
+
+    The database pool has already opened DB_POOL_MIN_SIZE connections,
+    with the statements prepared. See app.database.prime_connection
+    """
+    from .models.user import preload_users
+
+    start = perf_counter()
+    # concurrent commands open one connection each
+    await asyncio.gather(
+        *(redis.ping() for _ in range(config.REDIS_POOL_MIN_SIZE))
+    )
+    users = await preload_users()
+    logger.info(
+        'Warmed up in {:.1f}ms. {} users preloaded',
+        (perf_counter() - start) * 1000,
+        users,
+    )
+
+
+async def log_connection_budget() -> None:
+    """
+    Logs the connections that all workers of all instances might open,
+    so that scaling out doesn't exhaust the database
+    """
+    processes = config.APP_INSTANCES * config.WORKERS
+    db_budget = processes * config.DB_POOL_MAX_SIZE
+    redis_budget = processes * config.REDIS_POOL_MAX_SIZE
+    max_connections = int(await db.fetch_val('SHOW max_connections'))
+    logger.info(
+        'Connection budget: {instances} instances x {workers} workers x '
+        '{db_pool} = {db_budget} of {max_connections} Postgres connections, '
+        'x {redis_pool} = {redis_budget} Redis connections',
+        instances=config.APP_INSTANCES,
+        workers=config.WORKERS,
+        db_pool=config.DB_POOL_MAX_SIZE,
+        db_budget=db_budget,
+        max_connections=max_connections,
+        redis_pool=config.REDIS_POOL_MAX_SIZE,
+        redis_budget=redis_budget,
+    )
+    available = max_connections - config.DB_RESERVED_CONNECTIONS
+    if db_budget > available:
+        logger.warning(
+            'The connection budget exceeds the {} available Postgres '
+            'connections. Reduce DB_POOL_MAX_SIZE or WORKERS',
+            available,
+        )
+
+
 async def connect_database(database: Database) -> None:
     @retry(stop=stop_after_delay(3), wait=wait_exponential(multiplier=0.2))
     async def _connect_to_db() -> None:
@@ -91,19 +206,9 @@ async def connect_database(database: Database) -> None:
         raise
 
 
-def create_db():
-    from sqlalchemy import create_engine
-
-    from .models import metadata
-
-    engine = create_engine(config.DATABASE_URL, echo=config.TESTING)
-    metadata.create_all(engine, checkfirst=True)
-
-
 async def start_database():
     await connect_database(db)
-    create_db()
-    # migrate_db()
+    await migrate(db)
 
 
 async def connect_redis():
@@ -2,20 +2,12 @@ from pathlib import Path
 from urllib.parse import urlencode
 
 from asyncpg.exceptions import IntegrityConstraintViolationError
-from fastapi import (
-    APIRouter,
-    BackgroundTasks,
-    Body,
-    Depends,
-    HTTPException,
-    Query,
-)
-from fastapi_mail import MessageSchema
+from fastapi import APIRouter, Body, Depends, HTTPException, Query
 from loguru import logger
 from pydantic import EmailStr
 
 from .. import config
-from ..mailer import mailer, templates
+from ..mailer import enqueue_message, render
 from ..models.user import (
     UserInfo,
     UserInsert,
@@ -24,11 +16,33 @@ from ..models.user import (
     insert,
     update,
 )
+from ..ratelimit import query_param, rate_limit
+from ..schemas.mail import Message
 from ..schemas.user import check_password
 from ..sessions import create_session, delete_session, session_exists
 
 router = APIRouter()
 
+email_rate_limits = [
+    Depends(
+        rate_limit(
+            'confirmation_ip',
+            config.IP_RATE_LIMIT,
+            config.IP_RATE_PERIOD,
+            strategy='token_bucket',
+        )
+    ),
+    Depends(
+        rate_limit(
+            'confirmation_email',
+            config.EMAIL_RATE_LIMIT,
+            config.EMAIL_RATE_PERIOD,
+            key=query_param('email'),
+            strategy='sliding_window',
+        )
+    ),
+]
+
 
 async def existing_session(session_id: str = Body(...)) -> str:
     if not await session_exists(session_id):
@@ -44,10 +58,9 @@ def validate_password(password: str = Body(...)) -> str:
     return password
 
 
-@router.get('/send_reset_password_instructions')
+@router.get('/send_reset_password_instructions', dependencies=email_rate_limits)
 async def send_reset_password_instructions(
     email: EmailStr,
-    background_tasks: BackgroundTasks,
     language: str = Query('en'),
 ):
     """
@@ -55,12 +68,9 @@ async def send_reset_password_instructions(
     """
     user = await get_user_by_email(email)
     if not user:
-        logger.warning(f'email {email} non-existent in the database')
+        logger.warning('email {} non-existent in the database', email)
         return
 
-    if await session_exists(f'{email}:*'):
-        raise HTTPException(429)
-
     session_id = await create_session(email, lifetime=3600)
     if language == 'pt-BR':
         subject = f'Redefina a senha para {config.APP_NAME}'
@@ -78,17 +88,14 @@ async def send_reset_password_instructions(
         'reset_password_link': link,
     }
     logger.debug(params)
-    template = templates.get_template(f'reset_password.{language.lower()}.txt')
-    text = template.render(params)
-    template = templates.get_template(f'reset_password.{language.lower()}.html')
-    html = template.render(params)
-    message = MessageSchema(
+    text, html = render('reset_password', language, **params)
+    message = Message(
         subject=subject,
         recipients=[email],
         body=text,
         html=html,
     )
-    background_tasks.add_task(mailer.send_message, message)
+    await enqueue_message(message)
     return
 
 
@@ -107,20 +114,16 @@ async def reset_password(
     return
 
 
-@router.get('/send_register_user_instructions')
+@router.get('/send_register_user_instructions', dependencies=email_rate_limits)
 async def send_register_user_instructions(
     email: EmailStr,
-    background_tasks: BackgroundTasks,
     language: str = Query('en'),
 ):
     user = await get_user_by_email(email)
     if user:
-        logger.warning(f'email {email} already exists in the database')
+        logger.warning('email {} already exists in the database', email)
         return
 
-    if await session_exists(f'{email}:*'):
-        raise HTTPException(429)
-
     session_id = await create_session(email, lifetime=3600)
     if language == 'pt-BR':
         subject = f'Confirme seu endereço de email para {config.APP_NAME}'
@@ -138,21 +141,14 @@ async def send_register_user_instructions(
         'register_user_link': link,
     }
     logger.debug(params)
-    template = templates.get_template(
-        f'email_confirmation.{language.lower()}.txt'
-    )
-    text = template.render(params)
-    template = templates.get_template(
-        f'email_confirmation.{language.lower()}.html'
-    )
-    html = template.render(params)
-    message = MessageSchema(
+    text, html = render('email_confirmation', language, **params)
+    message = Message(
         subject=subject,
         recipients=[email],
         body=text,
         html=html,
     )
-    background_tasks.add_task(mailer.send_message, message)
+    await enqueue_message(message)
     return
 
 
@@ -1,9 +1,10 @@
 from fastapi import APIRouter, Cookie, HTTPException, Response
 from pydantic import BaseModel, EmailStr
 
-from ..models.user import get_user_by_login
+from ..authentication import create_user_session, delete_user_session
+from ..models.user import cache_user, get_user_by_login
 from ..schemas.user import UserInfo
-from ..sessions import create_csrf, create_session, delete_session
+from ..sessions import create_csrf
 
 router = APIRouter()
 
@@ -18,11 +19,12 @@ async def login(
     rec: LoginInfo, response: Response, session_id: str = Cookie(None)
 ) -> UserInfo:
     if session_id:
-        await delete_session(session_id)
+        await delete_user_session(session_id)
     user = await get_user_by_login(rec.email, rec.password)
     if user is None:
         raise HTTPException(status_code=404, detail='invalid email or password')
-    session_id = await create_session(f'user:{user.id}')
+    session_id = await create_user_session(user.id)
+    await cache_user(user)  # the next authenticated request skips the database
     response.set_cookie(
         key='session_id', value=session_id, httponly=True, secure=True
     )
@@ -33,7 +35,7 @@ async def login(
 @router.post('/logout', status_code=204)
 async def logout(response: Response, session_id: str = Cookie(None)) -> None:
     if session_id is not None:
-        await delete_session(session_id)
+        await delete_user_session(session_id)
     response.status_code = 204
     response.delete_cookie(key='session_id')
     return
@@ -0,0 +1,35 @@
+from ipaddress import ip_address
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+
+from .. import config
+from ..mailer import queue_depth
+from ..metrics import EMAIL_QUEUE_DEPTH, latest
+
+router = APIRouter()
+
+
+def internal_client(request: Request) -> None:
+    """
+    Metrics are only served to the networks in config.METRICS_NETWORKS
+    """
+    try:
+        address = ip_address(request.client.host) if request.client else None
+    except ValueError:
+        address = None
+    if address is None or not any(
+        address in network for network in config.METRICS_NETWORKS
+    ):
+        raise HTTPException(status_code=404)
+
+
+@router.get(
+    '/metrics', include_in_schema=False, dependencies=[Depends(internal_client)]
+)
+async def metrics() -> Response:
+    """
+    Metrics in Prometheus text format
+    """
+    EMAIL_QUEUE_DEPTH.set(await queue_depth())
+    content, media_type = latest()
+    return Response(content, media_type=media_type)
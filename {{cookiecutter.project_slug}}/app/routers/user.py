@@ -1,12 +1,32 @@
+from typing import Any, AsyncIterator, Mapping, Optional
+
+import orjson as json
 from asyncpg.exceptions import IntegrityConstraintViolationError
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import (
+    APIRouter,
+    Depends,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+)
+from fastapi.responses import StreamingResponse
 from loguru import logger
 
-from ..authentication import authenticated_user
-from ..models.user import delete, update
-from ..resources import redis
+from .. import config, user_import
+from ..authentication import admin_user, authenticated_user, delete_user_sessions
+from ..database import run_detached
+from ..models.user import (
+    delete,
+    etag,
+    iterate_users,
+    list_users,
+    serialize,
+    update,
+)
 from ..schemas import diff_models
-from ..schemas.user import UserInfo, UserPatch
+from ..schemas.user import UserInfo, UserPage, UserPatch
 
 router = APIRouter(prefix='/users', tags=['users'])
 
@@ -20,19 +40,116 @@ async def self_user(
     raise HTTPException(403)
 
 
-@router.get('', status_code=405)
-async def get_all():
-    return
+async def ndjson(
+    records: AsyncIterator[Mapping[str, Any]], lines_per_chunk: int = 100
+) -> AsyncIterator[bytes]:
+    lines = []
+    async for record in records:
+        lines.append(json.dumps(dict(record)))
+        if len(lines) >= lines_per_chunk:
+            yield b'\n'.join(lines) + b'\n'
+            lines = []
+    if lines:
+        yield b'\n'.join(lines) + b'\n'
+
+
+@router.get('', response_model=UserPage, dependencies=[Depends(admin_user)])
+async def get_all(
+    after: Optional[int] = None,
+    limit: int = Query(
+        config.USERS_PAGE_SIZE, ge=1, le=config.USERS_PAGE_MAX_SIZE
+    ),
+    name: Optional[str] = None,
+    email: Optional[str] = None,
+    format: str = Query('json', regex='^(json|ndjson)$'),
+):
+    """
+    Lists the users ordered by id, a page at a time.
+    The next page starts after the id returned in ``next``.
+
+    ``format=ndjson`` streams all the users after ``after``, one per line,
+    ignoring ``limit``.
+    """
+    if format == 'ndjson':
+        return StreamingResponse(
+            ndjson(iterate_users(after, name, email)),
+            media_type='application/x-ndjson',
+        )
+    # one more record tells whether there is a next page
+    records = await list_users(limit + 1, after, name, email)
+    users = [dict(record) for record in records[:limit]]
+    page = {
+        'users': users,
+        'next': users[-1]['id'] if len(records) > limit else None,
+    }
+    return Response(json.dumps(page), media_type='application/json')
+
+
+def etag_matches(tag: str, if_none_match: Optional[str]) -> bool:
+    """
+    If-None-Match uses the weak comparison. ref: RFC 7232, 3.2
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    return any(
+        candidate.strip().removeprefix('W/') == tag
+        for candidate in if_none_match.split(',')
+    )
+
+
+def user_response(
+    user: UserInfo, if_none_match: Optional[str] = None
+) -> Response:
+    """
+    Cached users are already validated and serialized,
+    so they skip the validation and serialization of response_model.
+
+    Clients must revalidate the user on every use (no-cache),
+    which costs an empty 304 response while it doesn't change.
+    """
+    tag = etag(user)
+    headers = {'ETag': tag, 'Cache-Control': 'private, no-cache'}
+    if etag_matches(tag, if_none_match):
+        return Response(status_code=304, headers=headers)
+    return Response(
+        serialize(user), media_type='application/json', headers=headers
+    )
+
+
+@router.post(
+    '/import',
+    response_model=user_import.ImportReport,
+    dependencies=[Depends(admin_user)],
+)
+async def import_users(
+    request: Request, format: str = Query('ndjson', regex='^(ndjson|csv)$')
+):
+    """
+    Bulk import of users from a NDJSON or CSV body. See app.user_import
+
+    It runs outside the request transaction, so that each batch
+    is committed as soon as it's imported.
+    """
+    return await run_detached(user_import.import_users(request.stream(), format))
 
 
 @router.get('/me', response_model=UserInfo)
-async def get_self_info(user: UserInfo = Depends(authenticated_user)):
-    return user
+async def get_self_info(
+    user: UserInfo = Depends(authenticated_user),
+    if_none_match: Optional[str] = Header(None),
+):
+    return user_response(user, if_none_match)
 
 
 @router.get('/{id}', response_model=UserInfo)
-async def get_user_info(id: int, user: UserInfo = Depends(self_user)):
-    return user
+async def get_user_info(
+    id: int,
+    user: UserInfo = Depends(self_user),
+    if_none_match: Optional[str] = Header(None),
+):
+    return user_response(user, if_none_match)
 
 
 @router.put('/{id}', status_code=204)
@@ -53,7 +170,5 @@ async def update_user(
 @router.delete('/{id}', status_code=204, dependencies=[Depends(self_user)])
 async def delete_user(id: int):
     await delete(id)
-    sessions = await redis.keys(f'user:{id}*')
-    if sessions:
-        await redis.delete(*sessions)
+    await delete_user_sessions(id)
     return
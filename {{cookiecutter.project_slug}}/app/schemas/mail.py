@@ -0,0 +1,10 @@
+from typing import Optional
+
+from pydantic import BaseModel, EmailStr
+
+
+class Message(BaseModel):
+    subject: str
+    recipients: list[EmailStr]
+    body: str
+    html: Optional[str]
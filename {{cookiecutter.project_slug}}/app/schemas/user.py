@@ -1,7 +1,7 @@
 import json
 from typing import Optional
 
-from pydantic import BaseModel, EmailStr, validator
+from pydantic import BaseModel, EmailStr, PrivateAttr, validator
 
 from ..config import PASSWORD_MIN_LENGTH, PASSWORD_MIN_VARIETY
 
@@ -22,6 +22,16 @@ class UserInfo(BaseModel):
     name: str
     email: EmailStr
 
+    # serialized user and its ETag, kept by the cache.
+    # See app.models.user.serialize and etag
+    _json: Optional[bytes] = PrivateAttr(None)
+    _etag: Optional[str] = PrivateAttr(None)
+
+
+class UserPage(BaseModel):
+    users: list[UserInfo]
+    next: Optional[int]  # value of 'after' for the next page, if there is one
+
 
 class UserInsert(BaseModel):
     name: str
@@ -1,4 +1,5 @@
 import hmac
+import time
 from base64 import b64encode
 from hashlib import sha256
 from secrets import token_urlsafe
@@ -7,6 +8,58 @@ from typing import Optional
 from . import config
 from .resources import redis
 
+# Sessions are indexed by prefix in sorted sets scored by their expiration time
+# (ms), so that listing or deleting all sessions of a user never scans the
+# keyspace. The index expires together with its longest-lived session.
+_create_session = redis.register_script(
+    """
+    local now = redis.call('TIME')
+    local now_ms = now[1] * 1000 + math.floor(now[2] / 1000)
+    local lifetime_ms = tonumber(ARGV[2]) * 1000
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', lifetime_ms)
+    redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now_ms)
+    redis.call('ZADD', KEYS[2], now_ms + lifetime_ms, KEYS[1])
+    local last = redis.call('ZRANGE', KEYS[2], -1, -1, 'WITHSCORES')
+    redis.call('PEXPIREAT', KEYS[2], last[2])
+    return 1
+    """
+)
+
+# Returns nil if the session doesn't exist or the values of the other KEYS.
+# A sliding session is extended when its remaining lifetime (ms) is below
+# ARGV[2]. ARGV[1] is its new lifetime (ms) or 0 for fixed sessions.
+_touch_session = redis.register_script(
+    """
+    local ttl = redis.call('PTTL', KEYS[1])
+    if ttl == -2 then
+        return false
+    end
+    local lifetime_ms = tonumber(ARGV[1])
+    if lifetime_ms > 0 and ttl >= 0 and ttl < tonumber(ARGV[2]) then
+        local now = redis.call('TIME')
+        local now_ms = now[1] * 1000 + math.floor(now[2] / 1000)
+        redis.call('PEXPIRE', KEYS[1], lifetime_ms)
+        redis.call('ZADD', KEYS[2], now_ms + lifetime_ms, KEYS[1])
+        local last = redis.call('ZRANGE', KEYS[2], -1, -1, 'WITHSCORES')
+        redis.call('PEXPIREAT', KEYS[2], last[2])
+    end
+    local values = {}
+    for i = 3, #KEYS do
+        values[i - 2] = redis.call('GET', KEYS[i])
+    end
+    return values
+    """
+)
+
+
+def session_index(prefix: str) -> str:
+    """Name of the sorted set that indexes the sessions of ``prefix``"""
+    return f'sessions:{prefix}'
+
+
+def session_prefix(session_id: str) -> str:
+    return session_id.rpartition(':')[0]
+
 
 async def create_session(
     prefix: str, payload: str = '', lifetime: Optional[int] = None
@@ -16,26 +69,67 @@ async def create_session(
     """
     session_id: str = f'{prefix}:{token_urlsafe(config.SESSION_ID_LENGTH)}'
     lifetime = lifetime or config.SESSION_LIFETIME
-    await redis.set(session_id, payload, ex=lifetime)
+    await _create_session(
+        keys=[session_id, session_index(prefix)], args=[payload, lifetime]
+    )
     return session_id
 
 
+async def touch_session(session_id: str, *keys: str) -> Optional[list]:
+    """
+    Checks that the session exists, extends it if sessions are sliding
+    and returns the values of ``keys``, all in a single round trip.
+
+    Returns None if the session doesn't exist.
+    """
+    lifetime = config.SESSION_LIFETIME if config.SESSION_SLIDING else 0
+    return await _touch_session(
+        keys=[session_id, session_index(session_prefix(session_id)), *keys],
+        args=[lifetime * 1000, config.SESSION_REFRESH_THRESHOLD * 1000],
+    )
+
+
 async def get_session_payload(session_id: str) -> Optional[str]:
     payload = await redis.get(session_id)
     return payload
 
 
-async def delete_session(*args) -> None:
-    await redis.delete(*args)
+async def delete_session(*session_ids: str) -> None:
+    if not session_ids:
+        return
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.unlink(*session_ids)
+        for session_id in session_ids:
+            pipe.zrem(session_index(session_prefix(session_id)), session_id)
+        await pipe.execute()
+
+
+async def list_sessions(prefix: str) -> list[str]:
+    """Returns the live sessions of ``prefix`` using its index"""
+    now_ms = int(time.time() * 1000)
+    sessions = await redis.zrangebyscore(session_index(prefix), now_ms, '+inf')
+    return [session.decode() for session in sessions]
+
+
+async def delete_sessions(prefix: str) -> None:
+    """Removes all sessions of ``prefix`` without blocking Redis"""
+    index = session_index(prefix)
+    sessions = await redis.zrange(index, 0, -1)
+    await redis.unlink(index, *sessions)
 
 
 async def session_keys(pattern: str) -> list[str]:
-    """Returns a list of keys matching ``pattern``"""
-    return await redis.keys(pattern)
+    """
+    Returns a list of keys matching ``pattern``.
+
+    It iterates over the whole keyspace (using SCAN, not KEYS),
+    so keep it out of the request path. Use list_sessions instead.
+    """
+    return [key async for key in redis.scan_iter(match=pattern, count=1000)]
 
 
 async def session_exists(session_id: str) -> bool:
-    return len(await session_keys(session_id)) > 0
+    return await redis.exists(session_id) > 0
 
 
 def create_csrf(session_id: str) -> str:
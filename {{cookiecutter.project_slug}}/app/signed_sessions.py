@@ -0,0 +1,127 @@
+"""
+Stateless user sessions.
+
+The session id is a token signed with config.SECRET_KEY that carries
+the session prefix and its issue and expiration times (Unix time)::
+
+    user:<id>:<issued>.<expires>.<signature>
+
+so it is validated locally, without Redis.
+Tokens signed with one of config.PREVIOUS_SECRET_KEYS are still accepted,
+which allows rotating the key without logging everybody out.
+
+Revoked sessions are stored in Redis and copied to every process.
+See Denylist.
+"""
+
+import asyncio
+import hmac
+from base64 import urlsafe_b64encode
+from hashlib import sha256
+from time import time
+from typing import NamedTuple, Optional
+
+from aioredis import Redis
+from loguru import logger
+
+from . import config
+
+DENYLIST = 'sessions:denylist'  # hash: signature or prefix -> Unix time
+
+
+class Token(NamedTuple):
+    prefix: str
+    issued: int
+    expires: int
+    signature: str
+
+
+def _sign(key: bytes, message: str) -> bytes:
+    digest = hmac.new(key, message.encode(), sha256).digest()
+    return urlsafe_b64encode(digest).rstrip(b'=')
+
+
+def create_token(prefix: str, lifetime: Optional[int] = None) -> str:
+    issued = int(time())
+    expires = issued + (lifetime or config.SESSION_LIFETIME)
+    message = f'{prefix}:{issued}.{expires}'
+    return f'{message}.{_sign(config.SECRET_KEY, message).decode()}'
+
+
+def parse_token(session_id: str) -> Optional[Token]:
+    """
+    Returns the fields of the token if it is authentic and not expired
+    """
+    message, _, signature = session_id.rpartition('.')
+    prefix, _, times = message.rpartition(':')
+    issued, _, expires = times.partition('.')
+    if not (prefix and issued.isdigit() and expires.isdigit()):
+        return None
+    if int(expires) <= time():
+        return None
+    for key in (config.SECRET_KEY, *config.PREVIOUS_SECRET_KEYS):
+        if hmac.compare_digest(signature.encode(), _sign(key, message)):
+            return Token(prefix, int(issued), int(expires), signature)
+    return None
+
+
+class Denylist:
+    """
+    In-process copy of the revoked sessions.
+
+    Entries are either token signatures, revoked until the token expires,
+    or session prefixes (e.g. user:123), which revoke all the tokens
+    issued up to the time of the revocation.
+
+    Lookups never touch Redis. Revocations made by other processes
+    are seen within config.SESSION_DENYLIST_REFRESH seconds.
+    """
+
+    def __init__(self) -> None:
+        self.entries: dict[str, int] = {}
+
+    def is_revoked(self, token: Token) -> bool:
+        return (
+            token.signature in self.entries
+            or self.entries.get(token.prefix, -1) >= token.issued
+        )
+
+    async def revoke(self, redis: Redis, key: str, value: int) -> None:
+        self.entries[key] = value
+        await redis.hset(DENYLIST, key, value)
+
+    @staticmethod
+    def _expiration(key: str, value: int) -> int:
+        if ':' in key:  # prefix. Its tokens expire in SESSION_LIFETIME at most
+            return value + config.SESSION_LIFETIME
+        return value
+
+    async def refresh(self, redis: Redis) -> None:
+        """
+        Merges the entries stored in Redis and drops the expired ones
+        """
+        stored = await redis.hgetall(DENYLIST)
+        self.entries.update(
+            (key.decode(), int(value)) for key, value in stored.items()
+        )
+        now = time()
+        expired = [
+            key
+            for key, value in self.entries.items()
+            if self._expiration(key, value) < now
+        ]
+        for key in expired:
+            del self.entries[key]
+        if expired:
+            await redis.hdel(DENYLIST, *expired)
+
+    async def keep_updated(self, redis: Redis) -> None:
+        while True:
+            await asyncio.sleep(config.SESSION_DENYLIST_REFRESH)
+            try:
+                await self.refresh(redis)
+            except Exception as error:
+                logger.warning(f'Could not refresh the denylist: {error!r}')
+
+
+denylist = Denylist()
@@ -0,0 +1,289 @@
+"""
+Request tracing.
+
+Sampled requests (config.TRACE_SAMPLE_RATE) get a root span
+and the spans opened while they are handled become its children::
+
+    with span('render email') as current:
+        if current:  # None outside sampled requests
+            current.attributes['template'] = name
+
+The current span is kept in a context variable,
+so it follows the request into the tasks it spawns.
+The sampling decision is made once, at the start of the request,
+or taken from the W3C traceparent header of the caller.
+Outside sampled requests, a span costs a context variable lookup.
+
+Finished spans are written by a background thread as OTLP JSON,
+one ExportTraceServiceRequest per line, to config.TRACE_EXPORT.
+"""
+
+import queue
+import socket
+import sys
+import threading
+import traceback
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from random import getrandbits, random
+from time import time_ns
+from typing import Any, Callable, Iterator, Optional
+
+import orjson as json
+
+from . import config
+from .metrics import TRACE_SPANS_DROPPED
+
+# OTLP span kinds and status code
+INTERNAL, SERVER, CLIENT = 1, 2, 3
+STATUS_ERROR = 2
+BATCH_SIZE = 64  # spans per line. It keeps UDP datagrams small
+
+
+class Span:
+    __slots__ = (
+        'name',
+        'kind',
+        'trace_id',
+        'span_id',
+        'parent_id',
+        'attributes',
+        'start',
+        'end',
+        'error',
+    )
+
+    def __init__(
+        self,
+        name: str,
+        kind: int,
+        trace_id: int,
+        parent_id: int,
+        attributes: dict[str, Any],
+    ) -> None:
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = getrandbits(64)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start = time_ns()
+        self.end = 0
+        self.error: Optional[str] = None
+
+    def to_otlp(self) -> dict[str, Any]:
+        data = {
+            'traceId': f'{self.trace_id:032x}',
+            'spanId': f'{self.span_id:016x}',
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start),
+            'endTimeUnixNano': str(self.end),
+            'attributes': [
+                {'key': key, 'value': _otlp_value(value)}
+                for key, value in self.attributes.items()
+            ],
+        }
+        if self.parent_id:
+            data['parentSpanId'] = f'{self.parent_id:016x}'
+        if self.error:
+            data['status'] = {'code': STATUS_ERROR, 'message': self.error}
+        return data
+
+
+def _otlp_value(value: Any) -> dict[str, Any]:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+current_span: ContextVar[Optional[Span]] = ContextVar(
+    'current_span', default=None
+)
+
+
+class Exporter:
+    """
+    Writes finished spans from a background thread.
+    When the queue is full, spans are dropped and counted.
+    """
+
+    def __init__(self, target: str, maxsize: int) -> None:
+        self.dropped = 0
+        self._write = self._open(target)
+        self._resource = {
+            'attributes': [
+                {'key': 'service.name', 'value': _otlp_value(config.APP_NAME)}
+            ]
+        }
+        self._queue: queue.Queue = queue.Queue(maxsize)
+        self._thread = threading.Thread(
+            target=self._run, name='trace_exporter', daemon=True
+        )
+        self._thread.start()
+
+    @staticmethod
+    def _open(target: str) -> Callable[[bytes], Any]:
+        if target.startswith('udp://'):
+            host, _, port = target.removeprefix('udp://').rpartition(':')
+            address = (host, int(port))
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            return lambda data: sock.sendto(data, address)
+        file = open(target, 'ab', buffering=0)  # one write per line
+        return file.write
+
+    def export(self, span: Span) -> None:
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+            TRACE_SPANS_DROPPED.inc()
+
+    def encode(self, spans: list[Span]) -> bytes:
+        request = {
+            'resourceSpans': [
+                {
+                    'resource': self._resource,
+                    'scopeSpans': [
+                        {
+                            'scope': {'name': 'app'},
+                            'spans': [span.to_otlp() for span in spans],
+                        }
+                    ],
+                }
+            ]
+        }
+        return json.dumps(request) + b'\n'
+
+    def _run(self) -> None:
+        while True:
+            spans = [self._queue.get()]
+            while len(spans) < BATCH_SIZE:
+                try:
+                    spans.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(self.encode(spans))
+            except Exception:  # the exporter must go on
+                traceback.print_exc(file=sys.__stderr__)
+            finally:
+                for _ in spans:
+                    self._queue.task_done()
+
+    def flush(self) -> None:
+        """
+        Waits until all queued spans are written
+        """
+        self._queue.join()
+
+
+exporter: Optional[Exporter] = None
+
+
+def setup_tracing() -> None:
+    global exporter
+
+    if config.TRACE_SAMPLE_RATE > 0 and exporter is None:
+        exporter = Exporter(config.TRACE_EXPORT, config.TRACE_QUEUE_SIZE)
+
+
+def flush_tracing() -> None:
+    if exporter is not None:
+        exporter.flush()
+
+
+def parse_traceparent(header: str) -> Optional[tuple[int, int, bool]]:
+    """
+    Returns the trace id, the parent span id and whether it is sampled.
+    ref: https://www.w3.org/TR/trace-context/#traceparent-header
+    """
+    parts = header.strip().split('-')
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        trace_id, parent_id = int(parts[1], 16), int(parts[2], 16)
+        sampled = bool(int(parts[3], 16) & 1)
+    except ValueError:
+        return None
+    if not (trace_id and parent_id):
+        return None
+    return trace_id, parent_id, sampled
+
+
+def start_trace(
+    name: str, traceparent: Optional[str] = None
+) -> Optional[tuple[Span, Token]]:
+    """
+    Starts the root span of a request if it is sampled
+    """
+    if exporter is None:
+        return None
+    parent = parse_traceparent(traceparent) if traceparent else None
+    if parent:
+        trace_id, parent_id, sampled = parent
+        if not sampled:
+            return None
+    elif random() < config.TRACE_SAMPLE_RATE:
+        trace_id, parent_id = getrandbits(128), 0
+    else:
+        return None
+    root = Span(name, SERVER, trace_id, parent_id, {})
+    return root, current_span.set(root)
+
+
+def finish(span: Span, error: Optional[BaseException] = None) -> None:
+    span.end = time_ns()
+    if error is not None:
+        span.error = repr(error)
+    if exporter is not None:
+        exporter.export(span)
+
+
+def end_trace(
+    trace: tuple[Span, Token], error: Optional[BaseException] = None
+) -> None:
+    root, token = trace
+    finish(root, error)
+    current_span.reset(token)
+
+
+def child_span(
+    name: str, kind: int = INTERNAL, attributes: Optional[dict[str, Any]] = None
+) -> Optional[Span]:
+    """
+    Returns a child span of the current one, without making it current,
+    or None outside sampled requests. It is recorded by finish()
+    """
+    parent = current_span.get()
+    if parent is None:
+        return None
+    return Span(name, kind, parent.trace_id, parent.span_id, attributes or {})
+
+
+@contextmanager
+def span(
+    name: str, kind: int = INTERNAL, attributes: Optional[dict[str, Any]] = None
+) -> Iterator[Optional[Span]]:
+    """
+    Records a child span of the current one, which is current inside the block.
+    It returns the span, or None outside sampled requests.
+    """
+    current = child_span(name, kind, attributes)
+    if current is None:
+        yield None
+        return
+    token = current_span.set(current)
+    try:
+        yield current
+    except BaseException as error:
+        finish(current, error)
+        raise
+    else:
+        finish(current)
+    finally:
+        current_span.reset(token)
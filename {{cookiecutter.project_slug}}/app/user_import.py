@@ -0,0 +1,202 @@
+"""
+Bulk import of users.
+
+Rows are streamed as NDJSON, one {"name", "email", "password"} object
+per line, or as CSV with a header line.
+Every IMPORT_BATCH_SIZE rows, passwords are hashed in the hashing pool
+and the users are loaded with COPY into a temporary table,
+from which they are inserted. Emails that already exist are reported
+as duplicates instead of aborting the import. Each batch is committed
+on its own, so an interrupted import keeps the batches already imported.
+
+Command line::
+
+    python -m app.user_import users.ndjson
+    python -m app.user_import users.csv
+    cat users.ndjson | python -m app.user_import - --format ndjson
+"""
+
+import argparse
+import asyncio
+import csv
+import sys
+from typing import Any, AsyncIterable, AsyncIterator, Optional
+
+import orjson as json
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import any_, bindparam, select
+
+from . import config
+from .database import Statement
+from .hashing import hash_passwords
+from .models import random_id
+from .models.user import User, UserInsert
+from .resources import db
+
+FORMATS = ('ndjson', 'csv')
+IMPORT_TABLE = 'user_import'
+COLUMNS = ['id', 'name', 'email', 'password_hash']
+CREATE_IMPORT_TABLE = (
+    f'CREATE TEMPORARY TABLE IF NOT EXISTS {IMPORT_TABLE} (LIKE "user")'
+)
+DROP_IMPORT_TABLE = f'DROP TABLE IF EXISTS {IMPORT_TABLE}'
+TRUNCATE_IMPORT_TABLE = f'TRUNCATE {IMPORT_TABLE}'
+INSERT_USERS = (
+    f'INSERT INTO "user" SELECT * FROM {IMPORT_TABLE} '
+    'ON CONFLICT DO NOTHING RETURNING email'
+)
+select_emails = Statement(
+    'user.select_emails',
+    select(User.c.email).where(User.c.email == any_(bindparam('emails'))),
+)
+
+
+class RowError(BaseModel):
+    line: int
+    error: str
+
+
+class ImportReport(BaseModel):
+    imported: int = 0
+    duplicates: list[str] = []
+    errors: list[RowError] = []
+
+
+async def split_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    rest = b''
+    async for chunk in chunks:
+        *lines, rest = (rest + chunk).split(b'\n')
+        for line in lines:
+            yield line
+    if rest:
+        yield rest
+
+
+async def parse(
+    chunks: AsyncIterable[bytes], format: str
+) -> AsyncIterator[tuple[int, Any]]:
+    """
+    Yields the line number and the fields of each row
+    or the error that prevented parsing it
+    """
+    header: Optional[list[str]] = None
+    number = 0
+    async for line in split_lines(chunks):
+        number += 1
+        line = line.strip()
+        if not line:
+            continue
+        row: Any
+        try:
+            if format == 'ndjson':
+                row = json.loads(line)
+            else:
+                fields = next(csv.reader([line.decode()]))
+                if header is None:
+                    header = fields
+                    continue
+                row = dict(zip(header, fields))
+        except (ValueError, csv.Error) as error:
+            row = error
+        yield number, row
+
+
+async def import_users(
+    chunks: AsyncIterable[bytes], format: str = 'ndjson'
+) -> ImportReport:
+    if format not in FORMATS:
+        raise ValueError(f'Invalid format: {format}')
+    report = ImportReport()
+    batch: list[UserInsert] = []
+    # the temporary table only exists in the connection that created it
+    async with db.connection():
+        await db.execute(CREATE_IMPORT_TABLE)
+        async for number, row in parse(chunks, format):
+            if isinstance(row, Exception):
+                report.errors.append(RowError(line=number, error=str(row)))
+                continue
+            try:
+                batch.append(UserInsert(**row))
+            except (ValidationError, TypeError) as error:
+                report.errors.append(RowError(line=number, error=str(error)))
+                continue
+            if len(batch) >= config.IMPORT_BATCH_SIZE:
+                await _import_batch(batch, report)
+                batch = []
+        if batch:
+            await _import_batch(batch, report)
+        await db.execute(DROP_IMPORT_TABLE)
+    return report
+
+
+async def _import_batch(users: list[UserInsert], report: ImportReport) -> None:
+    unique: dict[str, UserInsert] = {}
+    for user in users:
+        if user.email in unique:
+            report.duplicates.append(user.email)
+        else:
+            unique[user.email] = user
+    users = list(unique.values())
+    hashes = await hash_passwords([user.password for user in users])
+    records = [(user.name, user.email, hash) for user, hash in zip(users, hashes)]
+
+    async with db.transaction():
+        while records:
+            await db.execute(TRUNCATE_IMPORT_TABLE)
+            async with db.connection() as connection:
+                async with connection._query_lock:
+                    await connection.raw_connection.copy_records_to_table(
+                        IMPORT_TABLE,
+                        records=[(random_id(), *record) for record in records],
+                        columns=COLUMNS,
+                    )
+            inserted = {
+                record['email'] for record in await db.fetch_all(INSERT_USERS)
+            }
+            report.imported += len(inserted)
+            emails = [email for _, email, _ in records if email not in inserted]
+            if not emails:
+                break
+            rows = await db.fetch_all(select_emails, {'emails': emails})
+            existing = {row['email'] for row in rows}
+            report.duplicates.extend(
+                email for email in emails if email in existing
+            )
+            # the others collided with existing ids. Try again with new ones
+            records = [
+                record
+                for record in records
+                if record[1] not in inserted and record[1] not in existing
+            ]
+
+
+async def read_file(path: str) -> AsyncIterator[bytes]:
+    file = sys.stdin.buffer if path == '-' else open(path, 'rb')
+    with file:
+        while chunk := await asyncio.to_thread(file.read, 1 << 16):
+            yield chunk
+
+
+async def main(path: str, format: str) -> None:
+    from .log import flush_logger, setup_logger
+    from .resources import connect_database
+
+    setup_logger()
+    await connect_database(db)
+    try:
+        report = await import_users(read_file(path), format)
+    finally:
+        await db.disconnect()
+        flush_logger()
+    print(report.json(indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python -m app.user_import')
+    parser.add_argument('path', help="NDJSON or CSV file. '-' for stdin")
+    parser.add_argument(
+        '--format', choices=FORMATS, help='Default: from the file extension'
+    )
+    args = parser.parse_args()
+    format = args.format or ('csv' if args.path.endswith('.csv') else 'ndjson')
+    asyncio.run(main(args.path, format))
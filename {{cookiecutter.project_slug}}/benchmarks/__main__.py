@@ -0,0 +1,164 @@
+"""
+Load test and benchmark of the app.
+
+Usage::
+
+    # run the scenarios against the app in-process
+    # or against a server that shares the same database and Redis
+    python -m benchmarks run [--url URL] [--duration SECONDS]
+        [--concurrency N] [--scenarios NAME ...] [--output FILE]
+
+    # compare two results and fail if there is any regression
+    python -m benchmarks compare BASELINE RESULTS [--threshold 0.1]
+
+The environment variables are the same as the app's. See ``make bench``.
+
+The rate limits are raised below only for the in-process app.
+A server given by ``--url`` must be started with IP_RATE_LIMIT and
+EMAIL_RATE_LIMIT just as high, or the confirmation scenarios get 429.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+from contextlib import AsyncExitStack
+from datetime import datetime, timezone
+from typing import Any
+
+# confirmation endpoints would answer 429 most of the time otherwise.
+# Only for the in-process app. See above
+os.environ.setdefault('IP_RATE_LIMIT', '1000000000')
+os.environ.setdefault('EMAIL_RATE_LIMIT', '1000000000')
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    from asgi_lifespan import LifespanManager
+    from httpx import AsyncClient
+
+    from app.main import app
+    from app.resources import connect_database, db
+
+    from .loadgen import run_scenario
+    from .scenarios import SCENARIOS, cleanup, setup
+
+    results = {}
+    async with AsyncExitStack() as stack:
+        if args.url:
+            await connect_database(db)
+            stack.push_async_callback(db.disconnect)
+            client = AsyncClient(base_url=args.url)
+        else:
+            await stack.enter_async_context(LifespanManager(app))
+            client = AsyncClient(app=app, base_url='http://testserver')
+        await stack.enter_async_context(client)
+        await setup()
+        stack.push_async_callback(cleanup)
+
+        for name in args.scenarios:
+            scenario, prepare = SCENARIOS[name]
+            for header in ('cookie', 'x-csrf-token'):  # start logged out
+                client.headers.pop(header, None)
+            if prepare:
+                await prepare(client)
+            result = results[name] = await run_scenario(
+                client, scenario, args.duration, args.concurrency
+            )
+            latency = result['latency']
+            print(
+                f'{name:30} {result["rps"]:10.1f} rps  '
+                f'p50 {latency["p50"]:8.2f} ms  '
+                f'p95 {latency["p95"]:8.2f} ms  '
+                f'p99 {latency["p99"]:8.2f} ms  '
+                f'errors {result["error_rate"]:.2%}',
+                file=sys.stderr,
+            )
+
+    return {
+        'meta': {
+            'date': datetime.now(timezone.utc).isoformat(),
+            'target': args.url or 'in-process',
+            'duration': args.duration,
+            'concurrency': args.concurrency,
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+        },
+        'scenarios': results,
+    }
+
+
+def compare(
+    baseline: dict[str, Any], results: dict[str, Any], threshold: float
+) -> bool:
+    """
+    Prints the differences between both results
+    and returns whether there is any regression beyond ``threshold``
+    """
+    regression = False
+    common = sorted(set(baseline['scenarios']) & set(results['scenarios']))
+    for name in common:
+        before = baseline['scenarios'][name]
+        after = results['scenarios'][name]
+        print(name)
+        metrics = [
+            ('rps', before['rps'], after['rps'], True),
+            *(
+                (p, before['latency'][p], after['latency'][p], False)
+                for p in ('p50', 'p95', 'p99')
+            ),
+        ]
+        for metric, old, new, higher_is_better in metrics:
+            change = (new - old) / old if old else 0.0
+            worse = -change if higher_is_better else change
+            flag = 'REGRESSION' if worse > threshold else ''
+            regression |= bool(flag)
+            print(f'    {metric:6} {old:12.2f} {new:12.2f} {change:+8.1%} {flag}')
+        old, new = before['error_rate'], after['error_rate']
+        flag = 'REGRESSION' if new > old else ''
+        regression |= bool(flag)
+        print(f'    {"errors":6} {old:12.2%} {new:12.2%} {"":8} {flag}')
+    return regression
+
+
+def main() -> None:
+    from .scenarios import SCENARIOS
+
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='run the benchmark')
+    run_parser.add_argument('--url', help='server URL. Default: in-process app')
+    run_parser.add_argument('--duration', type=float, default=10)
+    run_parser.add_argument('--concurrency', type=int, default=10)
+    run_parser.add_argument(
+        '--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS)
+    )
+    run_parser.add_argument('--output', help='JSON file. Default: stdout')
+
+    compare_parser = subparsers.add_parser('compare', help='compare results')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('results')
+    compare_parser.add_argument('--threshold', type=float, default=0.1)
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        results = asyncio.run(run(args))
+        content = json.dumps(results, indent=2)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(content)
+        else:
+            print(content)
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.results) as f:
+            results = json.load(f)
+        if compare(baseline, results, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Scenario-driven asynchronous load generator.
+
+Each scenario is a coroutine that performs one iteration (usually one request)
+and returns whether it succeeded.
+A number of concurrent virtual users repeat the scenario until the deadline.
+"""
+
+import asyncio
+from dataclasses import dataclass, field
+from math import ceil
+from time import perf_counter
+from typing import Any, Awaitable, Callable
+
+from httpx import AsyncClient
+
+Scenario = Callable[[AsyncClient], Awaitable[bool]]
+
+
+def percentile(values: list[float], p: float) -> float:
+    """
+    Nearest-rank percentile of sorted ``values``
+    """
+    if not values:
+        return 0.0
+    index = max(ceil(p / 100 * len(values)) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+@dataclass
+class Result:
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+
+    def summary(self, elapsed: float) -> dict[str, Any]:
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+        mean = sum(latencies) / count if count else 0.0
+        return {
+            'requests': count,
+            'errors': self.errors,
+            'error_rate': self.errors / count if count else 0.0,
+            'duration': elapsed,
+            'rps': count / elapsed if elapsed else 0.0,
+            'latency': {  # milliseconds
+                'mean': 1000 * mean,
+                'p50': 1000 * percentile(latencies, 50),
+                'p95': 1000 * percentile(latencies, 95),
+                'p99': 1000 * percentile(latencies, 99),
+                'max': 1000 * latencies[-1] if latencies else 0.0,
+            },
+        }
+
+
+async def run_scenario(
+    client: AsyncClient, scenario: Scenario, duration: float, concurrency: int
+) -> dict[str, Any]:
+    result = Result()
+    deadline = perf_counter() + duration
+
+    async def virtual_user() -> None:
+        while perf_counter() < deadline:
+            start = perf_counter()
+            try:
+                ok = await scenario(client)
+            except Exception:
+                ok = False
+            result.latencies.append(perf_counter() - start)
+            result.errors += not ok
+
+    start = perf_counter()
+    await asyncio.gather(*(virtual_user() for _ in range(concurrency)))
+    return result.summary(perf_counter() - start)
@@ -0,0 +1,109 @@
+"""
+Benchmark scenarios.
+
+The benchmark user is created straight in the database,
+so the same scenarios run against the app in-process or against a server
+that shares the database and Redis containers.
+"""
+
+from itertools import count
+from typing import Awaitable, Callable, Optional
+from uuid import uuid4
+
+from httpx import AsyncClient
+
+from app.models.user import User, UserInsert, get_user_by_email, insert
+from app.resources import db
+from app.sessions import create_session
+
+from .loadgen import Scenario
+
+Prepare = Callable[[AsyncClient], Awaitable[None]]
+
+EMAIL = 'bench-user@example.com'
+PASSWORD = 'benchmark password 1234!'
+CREDENTIALS = {'email': EMAIL, 'password': PASSWORD}
+user_id = 0
+_names = count()
+
+
+def _new_email() -> str:
+    return f'bench-new-{uuid4().hex}@example.com'
+
+
+async def setup() -> None:
+    global user_id
+    user = await get_user_by_email(EMAIL)
+    if user:
+        user_id = user.id
+    else:
+        user_id = await insert(
+            UserInsert(name='Bench User', email=EMAIL, password=PASSWORD)
+        )
+
+
+async def cleanup() -> None:
+    """
+    Deletes the users registered by the scenarios. The benchmark user is kept
+    """
+    await db.execute(User.delete().where(User.c.email.like('bench-new-%')))
+
+
+async def authenticate(client: AsyncClient) -> None:
+    resp = await client.post('/login', json=CREDENTIALS)
+    resp.raise_for_status()
+    # the session cookie is Secure, so the cookie jar of the client
+    # would never send it to a plain http URL
+    client.headers['cookie'] = f'session_id={resp.cookies["session_id"]}'
+    client.headers['x-csrf-token'] = resp.headers['x-csrf-token']
+
+
+async def login(client: AsyncClient) -> bool:
+    resp = await client.post('/login', json=CREDENTIALS)
+    return resp.status_code == 200
+
+
+async def me(client: AsyncClient) -> bool:
+    resp = await client.get('/users/me')
+    return resp.status_code == 200
+
+
+async def update_user(client: AsyncClient) -> bool:
+    resp = await client.put(
+        f'/users/{user_id}', json={'name': f'Bench User {next(_names)}'}
+    )
+    return resp.status_code == 204
+
+
+async def reset_password_instructions(client: AsyncClient) -> bool:
+    resp = await client.get(
+        '/send_reset_password_instructions', params={'email': EMAIL}
+    )
+    return resp.status_code == 200
+
+
+async def register_user_instructions(client: AsyncClient) -> bool:
+    resp = await client.get(
+        '/send_register_user_instructions', params={'email': _new_email()}
+    )
+    return resp.status_code == 200
+
+
+async def register_user(client: AsyncClient) -> bool:
+    email = _new_email()
+    session_id = await create_session(email, lifetime=3600)
+    user = {'name': 'Bench User', 'email': email, 'password': PASSWORD}
+    resp = await client.post(
+        '/register_user', json={'session_id': session_id, 'user': user}
+    )
+    return resp.status_code == 201
+
+
+SCENARIOS: dict[str, tuple[Scenario, Optional[Prepare]]] = {
+    'login': (login, None),
+    'me': (me, authenticate),
+    'update_user': (update_user, authenticate),
+    'reset_password_instructions': (reset_password_instructions, None),
+    'register_user_instructions': (register_user_instructions, None),
+    'register_user': (register_user, None),
+}
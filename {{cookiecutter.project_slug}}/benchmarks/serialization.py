@@ -0,0 +1,64 @@
+"""
+CPU cost per request of returning a cached user.
+
+Compares validating the cached record and serializing it through
+``response_model`` (the previous approach) to returning the cached bytes.
+
+Usage::
+
+    python -m benchmarks.serialization [--number N]
+"""
+
+import argparse
+import asyncio
+from time import perf_counter
+
+import orjson as json
+from fastapi.responses import ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from app.models.user import trusted_user
+from app.routers.user import user_response
+from app.schemas.user import UserInfo
+
+cached = json.dumps(
+    {'id': 1234, 'name': 'Bench User', 'email': 'bench-user@example.com'}
+)
+field = create_response_field(name='Response_get_self_info', type_=UserInfo)
+
+
+async def validated() -> None:
+    user = UserInfo(**json.loads(cached))
+    content = await serialize_response(field=field, response_content=user)
+    ORJSONResponse(content)
+
+
+async def trusted() -> None:
+    user_response(trusted_user(cached))
+
+
+async def measure(func, number: int) -> float:
+    await func()  # warm up
+    start = perf_counter()
+    for _ in range(number):
+        await func()
+    return (perf_counter() - start) / number
+
+
+async def run(number: int) -> None:
+    before = await measure(validated, number)
+    after = await measure(trusted, number)
+    print(f'{"validate + response_model":30} {before * 1e6:10.1f} µs')
+    print(f'{"cached bytes":30} {after * 1e6:10.1f} µs')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.serialization')
+    parser.add_argument('--number', type=int, default=10_000)
+    args = parser.parse_args()
+    asyncio.run(run(args.number))
+
+
+if __name__ == '__main__':
+    main()
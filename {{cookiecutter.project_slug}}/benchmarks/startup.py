@@ -0,0 +1,91 @@
+"""
+Startup time of the app.
+
+Each run starts a fresh interpreter and measures how long it takes
+to import app.main (import) and to run the lifespan startup after that
+(ready is measured from the start of the import, so it includes it).
+Fails if the median of any of them exceeds its budget, in seconds.
+
+Usage::
+
+    python -m benchmarks.startup [--runs N]
+        [--import-budget SECONDS] [--ready-budget SECONDS]
+
+The budgets can also be set by STARTUP_IMPORT_BUDGET
+and STARTUP_READY_BUDGET.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+from statistics import median
+from time import perf_counter
+
+
+async def measure() -> dict[str, float]:
+    """
+    Runs in the child process
+    """
+    start = perf_counter()
+    from app.main import app
+
+    imported = perf_counter()
+
+    from asgi_lifespan import LifespanManager
+
+    async with LifespanManager(app):
+        ready = perf_counter()
+    return {'import': imported - start, 'ready': ready - start}
+
+
+def run_once() -> dict[str, float]:
+    result = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.startup', '--child'],
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.startup')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument(
+        '--import-budget',
+        type=float,
+        default=float(os.getenv('STARTUP_IMPORT_BUDGET', 1.0)),
+    )
+    parser.add_argument(
+        '--ready-budget',
+        type=float,
+        default=float(os.getenv('STARTUP_READY_BUDGET', 2.0)),
+    )
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(measure())))
+        return
+
+    runs = [run_once() for _ in range(args.runs)]
+    over_budget = False
+    for name, budget in (
+        ('import', args.import_budget),
+        ('ready', args.ready_budget),
+    ):
+        elapsed = median(run[name] for run in runs)
+        flag = 'OVER BUDGET' if elapsed > budget else ''
+        over_budget |= bool(flag)
+        print(
+            f'{name:10} {elapsed * 1000:10.1f} ms  '
+            f'budget {budget * 1000:8.1f} ms  {flag}'
+        )
+    if over_budget:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
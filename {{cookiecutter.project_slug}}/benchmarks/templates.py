@@ -0,0 +1,75 @@
+"""
+Cost of rendering an email.
+
+Compares looking templates up on each render (the previous approach)
+to rendering the precompiled ones.
+
+Usage::
+
+    python -m benchmarks.templates [--number N]
+"""
+
+import argparse
+from timeit import timeit
+
+from jinja2 import Environment, FileSystemLoader
+
+from app import mailer
+
+params = {
+    'name': 'Fulano',
+    'app_name': 'Benchmark',
+    'app_url': 'https://example.com',
+    'email': 'bench-user@example.com',
+    'reset_password_link': 'https://example.com/reset_password?session_id=1',
+}
+
+
+def lookup_and_render() -> None:
+    for extension in ('txt', 'html'):
+        template = mailer.environment().get_template(
+            f'reset_password.en.{extension}'
+        )
+        template.render(params)
+
+
+def precompiled_render() -> None:
+    mailer.render('reset_password', 'en', **params)
+
+
+def compile_all() -> None:
+    mailer.compiled.clear()
+    mailer.environment().cache.clear()  # type: ignore
+    mailer.load_templates()
+
+
+def compile_all_without_bytecode_cache() -> None:
+    environment = Environment(
+        loader=FileSystemLoader(mailer.templates_path), autoescape=True
+    )
+    for path in mailer.templates_path.glob('*.*.*'):
+        environment.get_template(path.name)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.templates')
+    parser.add_argument('--number', type=int, default=10_000)
+    args = parser.parse_args()
+
+    mailer.config.DEBUG = False  # production mode
+    benchmarks = [
+        ('lookup + render', lookup_and_render, args.number),
+        ('precompiled render', precompiled_render, args.number),
+        ('compile all', compile_all_without_bytecode_cache, 100),
+        ('compile all (bytecode cache)', compile_all, 100),
+    ]
+    for name, func, number in benchmarks:
+        # the previous approach checked the template files on every lookup
+        mailer.environment().auto_reload = func is lookup_and_render
+        func()  # warm up
+        elapsed = timeit(func, number=number)
+        print(f'{name:30} {elapsed / number * 1e6:10.1f} µs')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,11 @@
 from unittest.mock import patch
 
-from databases import Database
 from loguru import logger
 
 from app import config
-from app.resources import connect_database, create_db
+from app.database import Database
+from app.migrate import migrate
+from app.resources import connect_database
 
 test_db = Database(config.DATABASE_URL)
 
@@ -14,7 +15,7 @@ async def populate_db():
     from app.models.user import get_all
 
     await connect_database(test_db)
-    create_db()
+    await migrate(test_db)
 
     records = await get_all()
     if records:
@@ -3,13 +3,22 @@ from uuid import uuid4
 
 from httpx import AsyncClient
 
-from app.mailer import mailer
+from app.mailer import MAIL_STREAM
 from app.models.user import UserInfo, UserInsert, get_user_by_login
+from app.resources import redis
+from app.schemas.mail import Message
 from app.sessions import create_session, delete_session, session_exists
 
 Users = list[UserInfo]
 
 
+async def enqueued_messages() -> list[Message]:
+    return [
+        Message.parse_raw(fields[b'message'])
+        for _, fields in await redis.xrange(MAIL_STREAM)
+    ]
+
+
 async def test_send_reset_password_instructions(
     users: Users, client: AsyncClient
 ) -> None:
@@ -32,14 +41,14 @@ async def test_send_reset_password_instructions(
     assert create_session.await_count == 0
 
     # valid existing email
-    with mailer.record_messages() as outbox:
-        resp = await client.get(
-            '/send_reset_password_instructions', params={'email': users[1].email}
-        )
+    resp = await client.get(
+        '/send_reset_password_instructions', params={'email': users[1].email}
+    )
     assert resp.status_code == 200
+    outbox = await enqueued_messages()
     assert len(outbox) == 1
-    assert 'no-reply@' in outbox[0]['from']
-    assert outbox[0]['To'] == users[1].email
+    assert outbox[0].recipients == [users[1].email]
+    assert outbox[0].html
 
     # too many requests
     with patch(
@@ -49,6 +58,7 @@ async def test_send_reset_password_instructions(
             '/send_reset_password_instructions', params={'email': users[1].email}
         )
     assert resp.status_code == 429
+    assert int(resp.headers['retry-after']) > 0
     assert create_session.await_count == 0
 
 
@@ -127,14 +137,14 @@ async def test_send_register_user_instructions(
 
     # valid non-existing email
     email = 'teste@email.com'
-    with mailer.record_messages() as outbox:
-        resp = await client.get(
-            '/send_register_user_instructions', params={'email': email}
-        )
+    resp = await client.get(
+        '/send_register_user_instructions', params={'email': email}
+    )
     assert resp.status_code == 200
+    outbox = await enqueued_messages()
     assert len(outbox) == 1
-    assert 'no-reply@' in outbox[0]['from']
-    assert outbox[0]['To'] == email
+    assert outbox[0].recipients == [email]
+    assert outbox[0].html
 
     # too many requests
     with patch(
@@ -144,6 +154,7 @@ async def test_send_register_user_instructions(
             '/send_register_user_instructions', params={'email': email}
         )
     assert resp.status_code == 429
+    assert int(resp.headers['retry-after']) > 0
     create_session.assert_not_awaited()
 
 
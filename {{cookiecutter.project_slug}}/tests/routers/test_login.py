@@ -3,6 +3,7 @@ from unittest.mock import AsyncMock, patch
 from httpx import AsyncClient
 from pytest import mark
 
+from app.resources import redis
 from app.schemas.user import UserInfo
 
 Users = list[UserInfo]
@@ -20,8 +21,22 @@ async def test_successful_login(users: Users, client: AsyncClient) -> None:
     session_id_props = set(resp.headers.get_list('set-cookie')[0].split('; '))
     assert {'HttpOnly', 'Secure', 'SameSite=lax'} <= session_id_props
 
+    # the user cache is primed, so the next request doesn't query the database
+    assert await redis.exists(f'user:{users[0].id}')
+    with patch(
+        'app.models.user.replicas.fetch_one', new_callable=AsyncMock
+    ) as fetch_one:
+        resp = await client.get(
+            '/users/me',
+            headers={'x-csrf-token': resp.headers['x-csrf-token']},
+            cookies=resp.cookies,
+        )
+    assert resp.status_code == 200
+    assert resp.json()['id'] == users[0].id
+    fetch_one.assert_not_awaited()
+
 
-@patch('app.routers.login.delete_session')
+@patch('app.routers.login.delete_user_session')
 async def test_successful_login_with_session_id(
     delete_session: AsyncMock, users: Users, client: AsyncClient
 ) -> None:
@@ -52,7 +67,7 @@ async def test_unsuccessful_login(client: AsyncClient) -> None:
     assert resp.headers.get('x-csrf-token') is None
 
 
-@patch('app.routers.login.delete_session')
+@patch('app.routers.login.delete_user_session')
 @mark.parametrize(
     'cookies,called', [({}, False), ({'session_id': 'abcd1234'}, True)]
 )
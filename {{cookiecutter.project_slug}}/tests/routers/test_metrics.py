@@ -0,0 +1,35 @@
+from ipaddress import ip_network
+
+from httpx import AsyncClient
+
+from app.schemas.user import UserInfo
+
+from ..utils import logged_session
+
+Users = list[UserInfo]
+
+
+async def test_metrics(users: Users, client: AsyncClient) -> None:
+    await logged_session(client, users[0].id)
+    resp = await client.get(f'/users/{users[0].id}')
+    assert resp.status_code == 200
+
+    resp = await client.get('/metrics')
+    assert resp.status_code == 200
+    assert resp.headers['content-type'].startswith('text/plain')
+    metrics = resp.text
+    assert (
+        'http_request_duration_seconds_count'
+        '{method="GET",route="/users/{id}",status="200"}'
+    ) in metrics
+    assert 'http_requests_in_progress' in metrics
+    assert 'db_query_duration_seconds_count{operation="fetch_one"}' in metrics
+    assert 'redis_command_duration_seconds_count{command="GET"}' in metrics
+    assert 'user_cache_requests_total{layer="local",result="miss"}' in metrics
+    assert 'email_queue_depth' in metrics
+
+
+async def test_metrics_networks(app, client: AsyncClient, monkeypatch) -> None:
+    monkeypatch.setattr('app.config.METRICS_NETWORKS', [ip_network('10.0.0.0/8')])
+    resp = await client.get('/metrics')  # from 127.0.0.1
+    assert resp.status_code == 404
@@ -1,15 +1,63 @@
+import orjson as json
 from httpx import AsyncClient
 
-from app.models.user import UserInfo, UserInsert, get_user
+from app.models.user import UserInfo, UserInsert, get_user, user_cache
+from app.resources import redis
 
 from ..utils import logged_session
 
 Users = list[UserInfo]
 
 
-async def test_get_users(client: AsyncClient) -> None:
+async def test_get_users(users: Users, client: AsyncClient, monkeypatch) -> None:
     resp = await client.get('/users')
-    assert resp.status_code == 405
+    assert resp.status_code == 401
+
+    await logged_session(client, users[0].id)
+    resp = await client.get('/users')
+    assert resp.status_code == 403
+
+    monkeypatch.setattr('app.config.ADMIN_EMAILS', {users[0].email.lower()})
+    expected = sorted((user.dict() for user in users), key=lambda u: u['id'])
+
+    # one page at a time
+    pages = []
+    params: dict = {'limit': 1}
+    while True:
+        resp = await client.get('/users', params=params)
+        assert resp.status_code == 200
+        page = resp.json()
+        pages.extend(page['users'])
+        if page['next'] is None:
+            break
+        params['after'] = page['next']
+    assert pages == expected
+
+    resp = await client.get('/users', params={'limit': 0})
+    assert resp.status_code == 422
+
+    # filters
+    resp = await client.get('/users', params={'email': 'FULANO@'})
+    assert [user['email'] for user in resp.json()['users']] == [
+        'fulano@email.com'
+    ]
+    resp = await client.get('/users', params={'name': 'de tal'})
+    assert len(resp.json()['users']) == len(users)
+    resp = await client.get('/users', params={'name': '%'})
+    assert resp.json() == {'users': [], 'next': None}
+
+    # streaming
+    resp = await client.get('/users', params={'format': 'ndjson'})
+    assert resp.status_code == 200
+    assert resp.headers['content-type'] == 'application/x-ndjson'
+    lines = resp.content.splitlines()
+    assert [json.loads(line) for line in lines] == expected
+    resp = await client.get(
+        '/users', params={'format': 'ndjson', 'after': expected[0]['id']}
+    )
+    assert [json.loads(line) for line in resp.content.splitlines()] == (
+        expected[1:]
+    )
 
 
 async def test_get_user(users: Users, client: AsyncClient) -> None:
@@ -36,6 +84,33 @@ async def test_get_user(users: Users, client: AsyncClient) -> None:
     assert resp.status_code == 403
 
 
+async def test_conditional_get(users: Users, client: AsyncClient) -> None:
+    await logged_session(client, users[0].id)
+    for url in ('/users/me', f'/users/{users[0].id}'):
+        resp = await client.get(url)
+        assert resp.status_code == 200
+        etag = resp.headers['etag']
+        assert etag.startswith('"') and etag.endswith('"')
+        assert resp.headers['cache-control'] == 'private, no-cache'
+
+        for if_none_match in (etag, f'"other", W/{etag}', '*'):
+            resp = await client.get(url, headers={'if-none-match': if_none_match})
+            assert resp.status_code == 304
+            assert resp.content == b''
+            assert resp.headers['etag'] == etag
+
+        resp = await client.get(url, headers={'if-none-match': '"other"'})
+        assert resp.status_code == 200
+
+    # a change of the user changes its ETag
+    resp = await client.put(f'/users/{users[0].id}', json={'name': 'Belafonte'})
+    assert resp.status_code == 204
+    resp = await client.get('/users/me', headers={'if-none-match': etag})
+    assert resp.status_code == 200
+    assert resp.json()['name'] == 'Belafonte'
+    assert resp.headers['etag'] != etag
+
+
 async def test_update_user(users: Users, client: AsyncClient) -> None:
     url = '/users/{}'
     email = 'fulano@pronus.io'
@@ -121,4 +196,11 @@ async def test_get_me(users: Users, client: AsyncClient):
     await logged_session(client, users[0].id)
     resp = await client.get('/users/me')
     assert resp.status_code == 200
+    assert resp.headers['content-type'] == 'application/json'
     assert UserInfo(**resp.json()) == users[0]
+
+    # served straight from the cache
+    user_cache.clear()
+    resp = await client.get('/users/me')
+    assert resp.status_code == 200
+    assert resp.content == await redis.get(f'user:{users[0].id}')
@@ -0,0 +1,111 @@
+import asyncio
+from unittest.mock import patch
+
+from app.cache import INVALIDATION_CHANNEL, LocalCache
+from app.database import RequestTransaction, request_transaction
+from app.models.user import (
+    RECENT_USERS,
+    UserInfo,
+    cache_user,
+    get_user,
+    preload_users,
+    serialize,
+    user_cache,
+)
+from app.resources import db, redis
+
+Users = list[UserInfo]
+
+
+def test_local_cache_lru() -> None:
+    cache = LocalCache('test_lru', maxsize=2, ttl=60)
+    cache.set(1, 'a')
+    cache.set(2, 'b')
+    assert cache.get(1) == 'a'  # 1 becomes the most recently used
+    cache.set(3, 'c')
+    assert cache.get(2) is None
+    assert cache.get(1) == 'a' and cache.get('3') == 'c'
+    assert len(cache) == 2
+    assert (cache.hits, cache.misses) == (3, 1)
+    assert cache.hit_ratio == 0.75
+
+
+def test_local_cache_ttl() -> None:
+    cache = LocalCache('test_ttl', maxsize=2, ttl=60)
+    with patch('app.cache.monotonic', return_value=1000):
+        cache.set(1, 'a')
+    with patch('app.cache.monotonic', return_value=1059):
+        assert cache.get(1) == 'a'
+    with patch('app.cache.monotonic', return_value=1061):
+        assert cache.get(1) is None
+    assert len(cache) == 0
+
+
+def test_local_cache_generation() -> None:
+    cache = LocalCache('test_generation', maxsize=2, ttl=60)
+    generation = cache.generation
+    cache.pop(1)  # invalidation while the value was being fetched
+    cache.set(1, 'stale', generation)
+    assert cache.get(1) is None
+
+    cache = LocalCache('test_disabled', maxsize=0, ttl=60)
+    cache.set(1, 'a')
+    assert cache.get(1) is None
+
+
+async def test_user_cache(users: Users) -> None:
+    user = users[0]
+    assert await get_user(user.id) == user
+    hits = user_cache.hits
+    assert await get_user(user.id) == user
+    assert user_cache.hits == hits + 1
+
+    # invalidation published by another worker
+    await redis.publish(INVALIDATION_CHANNEL, f'users:{user.id}')
+    for _ in range(100):
+        if user_cache.get(user.id) is None:
+            break
+        await asyncio.sleep(0.01)
+    else:
+        raise AssertionError('user cache was not invalidated')
+
+
+async def test_read_your_writes(users: Users) -> None:
+    """
+    Clients that wrote recently skip the caches,
+    which might have been filled from a lagging replica
+    """
+    user = users[0]
+    stale = UserInfo(id=user.id, name='Stale', email=user.email)
+    await redis.set(f'user:{user.id}', serialize(stale))
+    user_cache.set(user.id, stale)
+    assert await get_user(user.id) == stale
+
+    transaction = RequestTransaction(db, readonly=True)
+    transaction.read_your_writes = True
+    token = request_transaction.set(transaction)
+    try:
+        assert await get_user(user.id) == user
+    finally:
+        request_transaction.reset(token)
+        await transaction.finish(commit=False)
+    # the record read from the primary replaced the stale one
+    assert user_cache.get(user.id) == user
+    assert await redis.get(f'user:{user.id}') == serialize(user)
+
+
+async def test_preload_users(users: Users, monkeypatch) -> None:
+    assert await preload_users() == 0  # disabled
+
+    monkeypatch.setattr('app.config.USER_PRELOAD_SIZE', 2)
+    for user in users:
+        await cache_user(user)
+    assert await redis.zcard(RECENT_USERS) == 2
+    await redis.delete(f'user:{users[0].id}')
+    user_cache.clear()
+
+    assert await preload_users() == 2
+    for user in users:
+        assert user_cache.get(user.id) == user
+    # the one that had expired in Redis is cached again
+    assert await redis.exists(f'user:{users[0].id}')
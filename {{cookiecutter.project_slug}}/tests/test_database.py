@@ -0,0 +1,199 @@
+from time import perf_counter
+from unittest.mock import AsyncMock, Mock, patch
+
+from asyncpg.exceptions import ReadOnlySQLTransactionError
+from loguru import logger
+from pytest import raises
+from sqlalchemy import bindparam
+
+from app import config, resources
+from app.database import (
+    Database,
+    Replicas,
+    RequestTransaction,
+    Statement,
+    after_commit,
+    dialect,
+    request_transaction,
+    statements,
+)
+from app.models.user import User, insert_user, select_by_id
+from app.resources import db
+from app.schemas.user import UserInfo
+
+
+async def test_replicas_routing() -> None:
+    primary = AsyncMock()
+    primary.fetch_one.return_value = 'primary'
+    replicas = Replicas(['postgresql://r1/db', 'postgresql://r2/db'], 30)
+    databases = [
+        AsyncMock(is_connected=True, **{'fetch_one.return_value': name})
+        for name in ('r1', 'r2')
+    ]
+    replicas.databases[:] = databases
+
+    # outside requests
+    assert await replicas.fetch_one(primary, 'select 1') == 'primary'
+
+    transaction = RequestTransaction(Mock(), readonly=True)
+    token = request_transaction.set(transaction)
+    try:
+        # round robin
+        results = [await replicas.fetch_one(primary, 'select 1') for _ in '123']
+        assert results == ['r1', 'r2', 'r1']
+
+        # failing replicas are ejected
+        failure = AsyncMock(side_effect=OSError())
+        with patch.object(replicas.databases[1], 'fetch_one', failure):
+            assert await replicas.fetch_one(primary, 'select 1') == 'primary'
+        results = [await replicas.fetch_one(primary, 'select 1') for _ in '12']
+        assert results == ['r1', 'r1']
+
+        # tells who answered
+        answer = await replicas.read(primary, 'fetch_one', 'select 1')
+        assert answer == ('r1', True)
+
+        # read-your-writes
+        transaction.read_your_writes = True
+        assert replicas.read_your_writes()
+        answer = await replicas.read(primary, 'fetch_one', 'select 1')
+        assert answer == ('primary', False)
+
+        # requests that might write, even before they do
+        transaction.read_your_writes = False
+        transaction.readonly = False
+        assert not replicas.in_use()
+        assert await replicas.fetch_one(primary, 'select 1') == 'primary'
+    finally:
+        request_transaction.reset(token)
+
+
+async def test_after_commit() -> None:
+    calls: list[int] = []
+
+    async def callback() -> None:
+        calls.append(len(calls))
+
+    await after_commit(callback)  # outside requests
+    assert calls == [0]
+
+    for commit in (False, True):
+        transaction = RequestTransaction(Mock())
+        transaction.connection = AsyncMock()
+        transaction.transaction = AsyncMock()  # started
+        token = request_transaction.set(transaction)
+        try:
+            await after_commit(callback)
+            assert calls == [0]
+        finally:
+            request_transaction.reset(token)
+        await transaction.finish(commit)
+    # only after the commit
+    assert calls == [0, 1]
+
+
+async def test_readonly_transaction(populate_test_db: None) -> None:
+    """
+    The request transactions of the other tests are nested in the transaction
+    that wraps each test, so they can't be read-only. This database isn't.
+    """
+    database = Database(config.DATABASE_URL)
+    await database.connect()
+    try:
+        for readonly, expected in ((False, 'off'), (True, 'on')):
+            transaction = RequestTransaction(database, readonly)
+            token = request_transaction.set(transaction)
+            try:
+                query = 'SHOW transaction_read_only'
+                assert await database.fetch_val(query) == expected
+                if readonly:
+                    with raises(ReadOnlySQLTransactionError):
+                        await database.execute('DELETE FROM "user" WHERE id = -1')
+            finally:
+                request_transaction.reset(token)
+                await transaction.finish(commit=False)
+    finally:
+        await database.disconnect()
+
+
+def test_statement() -> None:
+    statement = Statement(
+        'test',
+        User.select()
+        .where(User.c.email == bindparam('email'))
+        .where(User.c.id > 10)
+        .limit(bindparam('limit')),
+    )
+    assert statements['test'] is statement
+    assert statement.params == ['email', 'id_1', 'limit']
+    assert '%' not in statement.sql
+    assert 'email = $1' in statement.sql and 'LIMIT $3' in statement.sql
+    # literal values are kept
+    assert statement.args({'email': 'a@b.com', 'limit': 5}) == ['a@b.com', 10, 5]
+    del statements['test']
+
+
+async def test_statement_queries(users: list[UserInfo]) -> None:
+    record = await db.fetch_one(select_by_id, {'id': users[0].id})
+    assert UserInfo(**record) == users[0]
+    assert await db.fetch_one(select_by_id, {'id': -1}) is None
+    assert await db.fetch_val(select_by_id, {'id': users[0].id}) == users[0].id
+    records = await db.fetch_all(select_by_id, {'id': users[0].id})
+    assert len(records) == 1
+
+
+async def test_statement_overhead(users: list[UserInfo]) -> None:
+    """
+    Micro-benchmark of the cost per query of building and compiling
+    a SQLAlchemy expression (as databases does) compared to a Statement
+    """
+    id = users[0].id
+    number = 1000
+
+    start = perf_counter()
+    for _ in range(number):
+        query = User.select(User.c.id == id)
+        query.compile(
+            dialect=dialect, compile_kwargs={'render_postcompile': True}
+        )
+    expression = (perf_counter() - start) / number
+
+    start = perf_counter()
+    for _ in range(number):
+        select_by_id.args({'id': id})
+    statement = (perf_counter() - start) / number
+
+    number = 100
+    start = perf_counter()
+    for _ in range(number):
+        await db.fetch_one(User.select(User.c.id == id))
+    expression_query = (perf_counter() - start) / number
+
+    start = perf_counter()
+    for _ in range(number):
+        await db.fetch_one(select_by_id, {'id': id})
+    statement_query = (perf_counter() - start) / number
+
+    logger.info(
+        f'per call. compile: {expression * 1e6:.1f} µs -> '
+        f'{statement * 1e6:.1f} µs. '
+        f'query: {expression_query * 1e6:.1f} µs -> '
+        f'{statement_query * 1e6:.1f} µs'
+    )
+    # timings are only logged; they vary too much between runs to assert on
+    assert select_by_id.sql.endswith('WHERE "user".id = $1')
+    assert select_by_id.args({'id': id}) == [id]
+    # parameters are numbered in the order of their names
+    assert insert_user.params == ['email', 'id', 'name', 'password_hash']
+    assert 'VALUES ($2, $3, $1, $4)' in insert_user.sql
+
+
+async def test_prepared_statements(app) -> None:
+    """
+    Pool connections are primed by app.database.prime_connection
+    """
+    assert resources.ready
+    records = await db.fetch_all('SELECT statement FROM pg_prepared_statements')
+    prepared = {record['statement'] for record in records}
+    for statement in statements.values():
+        assert statement.sql in prepared
@@ -0,0 +1,67 @@
+from unittest.mock import patch
+
+from httpx import AsyncClient
+from prometheus_client import REGISTRY
+from pytest import raises
+
+from app.hashing import (
+    HashingOverloadedError,
+    hash_password,
+    hash_passwords,
+    pool,
+    verify_password,
+)
+from app.schemas.user import UserInfo
+
+Users = list[UserInfo]
+
+
+def sample(name: str) -> float:
+    return REGISTRY.get_sample_value(name) or 0
+
+
+async def test_hash_and_verify_password() -> None:
+    calls = sample('password_hash_duration_seconds_count')
+    password = 'Paulo Paulada Power'
+    hash = await hash_password(password)
+    assert hash.startswith('$argon2')
+    assert await verify_password(password, hash)
+    assert not await verify_password('wrong password', hash)
+    assert sample('password_hash_duration_seconds_count') == calls + 3
+    assert sample('password_hash_duration_seconds_sum') > 0
+    assert pool.pending == 0
+
+
+async def test_hash_passwords() -> None:
+    calls = sample('password_hash_duration_seconds_count')
+    passwords = ['Paulo Paulada Power', 'Beltrano Power', 'Fulano Power']
+    hashes = await hash_passwords(passwords, chunk_size=2)
+    assert len(hashes) == 3
+    assert all(hash.startswith('$argon2') for hash in hashes)
+    # one observation per password, not per chunk
+    assert sample('password_hash_duration_seconds_count') == calls + 3
+    assert pool.pending == 0
+
+
+async def test_pool_shutdown(app) -> None:
+    await hash_password('Paulo Paulada Power')
+    assert pool._executor is not None
+    pool.shutdown()
+    assert pool._executor is None
+    # the workers are started again on demand
+    assert (await hash_password('Paulo Paulada Power')).startswith('$argon2')
+
+
+async def test_admission_control(users: Users, client: AsyncClient) -> None:
+    rejected = sample('password_hash_rejected_total')
+    with patch.object(pool, 'pending', pool.size + pool.max_queue):
+        with raises(HashingOverloadedError):
+            await hash_password('Paulo Paulada Power')
+
+        resp = await client.post(
+            '/login',
+            json={'email': users[0].email, 'password': 'Paulo Paulada Power'},
+        )
+    assert resp.status_code == 503
+    assert resp.headers['retry-after'] == '1'
+    assert sample('password_hash_rejected_total') == rejected + 2
@@ -0,0 +1,47 @@
+from unittest.mock import patch
+
+from httpx import AsyncClient
+
+from app import resources
+from app.resources import health
+
+
+async def test_probes(client: AsyncClient) -> None:
+    with patch('app.middlewares._dispatch') as dispatch:
+        resp = await client.get('/healthz')
+        assert resp.status_code == 200
+        assert resp.json() == {'status': 'ok'}
+
+        resp = await client.get('/readyz')
+        assert resp.status_code == 200
+        assert resp.headers['cache-control'] == 'no-store'
+        result = resp.json()
+    # no transaction middleware
+    dispatch.assert_not_called()
+    assert result['status'] == 'ok'
+    for name in ('postgres', 'redis'):
+        assert result['checks'][name]['status'] == 'ok'
+        assert result['checks'][name]['latency_ms'] >= 0
+
+
+async def test_readiness(client: AsyncClient, monkeypatch) -> None:
+    async def down() -> None:
+        raise ConnectionError('Redis is down')
+
+    monkeypatch.setitem(health.checks, 'redis', down)
+    await health.check()
+    resp = await client.get('/readyz')
+    assert resp.status_code == 503
+    result = resp.json()
+    assert result['status'] == 'degraded'
+    assert result['checks']['postgres']['status'] == 'ok'
+    assert result['checks']['redis']['status'] == 'down'
+    assert 'Redis is down' in result['checks']['redis']['error']
+
+    monkeypatch.setattr(resources, 'ready', False)
+    resp = await client.get('/readyz')
+    assert resp.status_code == 503
+    assert resp.json() == {'status': 'starting'}
+    # still alive
+    resp = await client.get('/healthz')
+    assert resp.status_code == 200
@@ -0,0 +1,93 @@
+import io
+import threading
+
+import orjson as json
+from httpx import AsyncClient
+from loguru import logger
+
+from app.log import BoundedSink, RequestLog, _sample, request_log
+
+
+class BlockedStream(io.StringIO):
+    def __init__(self) -> None:
+        super().__init__()
+        self.writing = threading.Event()
+        self.unblocked = threading.Event()
+
+    def write(self, text: str) -> int:
+        self.writing.set()
+        self.unblocked.wait()
+        return super().write(text)
+
+
+def test_bounded_sink() -> None:
+    stream = BlockedStream()
+    sink = BoundedSink(stream, maxsize=2, serialize=True)
+    handler = logger.add(sink, format='{message}')
+    try:
+        logger.info('message {}', 0, field=0)
+        stream.writing.wait()
+        for i in range(1, 10):
+            logger.info('message {}', i, field=i)
+        # one message is being written and two are queued
+        assert sink.dropped == 7
+        stream.unblocked.set()
+        sink.flush()
+    finally:
+        logger.remove(handler)
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [line['message'] for line in lines] == [
+        'message 0',
+        'message 1',
+        'message 2',
+    ]
+    assert lines[0]['level'] == 'INFO' and lines[0]['field'] == 0
+
+
+def test_sampling(monkeypatch) -> None:
+    monkeypatch.setattr('app.config.LOG_SAMPLE_RATE', 1)
+    monkeypatch.setattr('app.config.LOG_SAMPLE_RATES', {'/metrics': 0})
+    assert RequestLog(lambda: '/users/me').sampled
+    assert not RequestLog(lambda: '/metrics').sampled
+
+    # the decision waits for the route
+    route = None
+    log = RequestLog(lambda: route)
+    assert log.sampled
+    route = '/metrics'
+    assert not log.sampled
+    assert not log.decide('/users/me')  # already made
+
+    log = RequestLog(lambda: None)  # never routed, e.g. 404
+    assert not log.decide('/metrics')
+
+    stream = io.StringIO()
+    handler = logger.add(
+        stream, level='DEBUG', format='{message}', filter=_sample
+    )
+    try:
+        token = request_log.set(RequestLog(lambda: '/metrics'))
+        logger.debug('not sampled')
+        logger.info('always logged')
+        request_log.reset(token)
+        logger.debug('outside requests')
+    finally:
+        logger.remove(handler)
+    assert stream.getvalue().splitlines() == ['always logged', 'outside requests']
+
+
+async def test_access_log(client: AsyncClient, monkeypatch) -> None:
+    monkeypatch.setattr('app.config.LOG_SAMPLE_RATES', {'/metrics': 0})
+    stream = io.StringIO()
+    handler = logger.add(
+        stream,
+        format='{message}',
+        filter=lambda record: 'route' in record['extra'],
+    )
+    try:
+        await client.get('/metrics')
+        await client.get('/users/me')
+    finally:
+        logger.remove(handler)
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 1 and lines[0].startswith('GET /users/me 401 ')
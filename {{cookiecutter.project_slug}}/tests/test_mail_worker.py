@@ -0,0 +1,144 @@
+import socket
+from typing import Iterator
+
+from aiosmtpd.controller import Controller
+from pytest import fixture, raises
+
+from app import mail_worker
+from app.mail_worker import SMTPPool, create_group, process_batch
+from app.mailer import (
+    DEAD_LETTER_STREAM,
+    MAIL_STREAM,
+    RETRY_QUEUE,
+    MailQueueFullError,
+    enqueue_message,
+    queue_depth,
+)
+from app.resources import redis
+from app.schemas.mail import Message
+
+message = Message(
+    subject='Test',
+    recipients=['fulano@email.com'],
+    body='Hello',
+    html='<p>Hello</p>',
+)
+
+
+class Handler:
+    def __init__(self) -> None:
+        self.envelopes: list = []
+
+    async def handle_DATA(self, server, session, envelope) -> str:  # noqa: N802
+        self.envelopes.append(envelope)
+        return '250 OK'
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@fixture
+def smtp_server() -> Iterator[Controller]:
+    controller = Controller(Handler(), hostname='127.0.0.1', port=free_port())
+    controller.start()
+    yield controller
+    controller.stop()
+
+
+async def test_send(app, smtp_server: Controller) -> None:
+    await create_group()
+    for _ in range(3):
+        await enqueue_message(message)
+    assert await queue_depth() == 3
+
+    pool = SMTPPool('127.0.0.1', smtp_server.port, size=2)
+    try:
+        assert await process_batch(pool, block=100) == (3, 0)
+    finally:
+        await pool.close()
+    assert await queue_depth() == 0
+    envelopes = smtp_server.handler.envelopes
+    assert len(envelopes) == 3
+    assert envelopes[0].rcpt_tos == message.recipients
+    assert b'<p>Hello</p>' in envelopes[0].content
+
+
+async def test_retry(app) -> None:
+    await create_group()
+    await enqueue_message(message)
+
+    pool = SMTPPool('127.0.0.1', free_port())  # nothing listens there
+    assert await process_batch(pool, block=100) == (0, 1)
+    assert await queue_depth() == 0
+    assert await redis.zcard(RETRY_QUEUE) == 1
+
+    # not due yet
+    assert await mail_worker.schedule_retries() == 0
+    # move the retry time to the past
+    item = (await redis.zrange(RETRY_QUEUE, 0, -1))[0]
+    await redis.zadd(RETRY_QUEUE, {item: 0})
+    assert await mail_worker.schedule_retries() == 1
+    assert await redis.zcard(RETRY_QUEUE) == 0
+    entries = await redis.xrange(MAIL_STREAM)
+    assert entries[0][1][b'attempts'] == b'1'
+
+
+async def test_dead_letter(app, monkeypatch) -> None:
+    monkeypatch.setattr('app.config.MAIL_MAX_ATTEMPTS', 1)
+    await create_group()
+    await enqueue_message(message)
+
+    pool = SMTPPool('127.0.0.1', free_port())
+    assert await process_batch(pool, block=100) == (0, 1)
+    assert await redis.zcard(RETRY_QUEUE) == 0
+    assert await redis.xlen(DEAD_LETTER_STREAM) == 1
+
+
+async def test_unreadable_entry(app) -> None:
+    await create_group()
+    await redis.xadd(MAIL_STREAM, {'message': 'not json', 'attempts': 0})
+
+    pool = SMTPPool('127.0.0.1', free_port())
+    assert await process_batch(pool, block=100) == (0, 1)
+    assert await queue_depth() == 0
+    assert await redis.zcard(RETRY_QUEUE) == 0
+    entries = await redis.xrange(DEAD_LETTER_STREAM)
+    assert entries[0][1][b'message'] == b'not json'
+
+
+async def test_entry_failure(app, smtp_server: Controller, monkeypatch) -> None:
+    await create_group()
+    for _ in range(2):
+        await enqueue_message(message)
+    deliver = mail_worker.deliver
+    calls = 0
+
+    async def flaky_deliver(pool: SMTPPool, fields: dict) -> bool:
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            raise ConnectionError()
+        return await deliver(pool, fields)
+
+    monkeypatch.setattr('app.mail_worker.deliver', flaky_deliver)
+    pool = SMTPPool('127.0.0.1', smtp_server.port)
+    try:
+        assert await process_batch(pool, block=100) == (1, 1)
+    finally:
+        await pool.close()
+    assert len(smtp_server.handler.envelopes) == 1
+    # the other entry is left pending, to be claimed again
+    assert await queue_depth() == 1
+
+
+async def test_queue_full(app, monkeypatch) -> None:
+    monkeypatch.setattr('app.config.MAIL_QUEUE_MAXLEN', 2)
+    for _ in range(2):
+        await enqueue_message(message)
+    with raises(MailQueueFullError):
+        await enqueue_message(message)
+    # nothing waiting was dropped to make room
+    assert await queue_depth() == 2
@@ -0,0 +1,26 @@
+from app.mailer import compiled, load_templates, render
+
+params = {
+    'app_name': 'Test App',
+    'app_url': 'https://test.app',
+    'email': 'fulano@email.com',
+    'register_user_link': 'https://test.app/register_user?session_id=123',
+}
+
+
+def test_load_templates() -> None:
+    load_templates()
+    assert ('reset_password', 'en', 'txt') in compiled
+    assert ('email_confirmation', 'pt-br', 'html') in compiled
+
+
+def test_render() -> None:
+    text, html = render('email_confirmation', 'en', **params)
+    assert params['register_user_link'] in text
+    assert '<' in html and params['email'] in html
+
+    pt_text, _ = render('email_confirmation', 'pt-BR', **params)
+    assert pt_text != text
+
+    # unknown languages fall back to the default one
+    assert render('email_confirmation', 'xx', **params) == (text, html)
@@ -1,23 +1,50 @@
+from typing import AsyncIterable
 from unittest.mock import patch
 
 from asyncpg.exceptions import InFailedSQLTransactionError, UniqueViolationError
 from fastapi import FastAPI, HTTPException
 from httpx import AsyncClient
-from pytest import raises
+from pytest import fixture, raises
 
-from app.models.user import UserInfo, UserInsert, delete, get_user, insert
+from app.database import request_transaction
+from app.middlewares import DBTransactionMiddleware
+from app.models.user import (
+    UserInfo,
+    UserInsert,
+    delete,
+    get_all,
+    get_user,
+    insert,
+)
 from app.resources import db
 
 Users = list[UserInfo]
 
 
+@fixture
+def local_app(app: FastAPI) -> FastAPI:
+    """
+    App with just the transaction middleware,
+    so that the test routes don't leak into the shared app
+    """
+    local_app = FastAPI()
+    local_app.add_middleware(DBTransactionMiddleware)
+    return local_app
+
+
+@fixture
+async def local_client(local_app: FastAPI) -> AsyncIterable[AsyncClient]:
+    async with AsyncClient(app=local_app, base_url='http://testserver') as client:
+        yield client
+
+
 async def test_dbtransactionwrappermiddleware(
-    app: FastAPI, client: AsyncClient, users: Users, connection
+    local_app: FastAPI, local_client: AsyncClient, users: Users, connection
 ):
-    async def dispatch(request, call_next):
-        return await call_next(request)
+    async def dispatch(app, scope, receive, send):
+        await app(scope, receive, send)
 
-    @app.post('/test_db_transaction_wrapper')
+    @local_app.post('/test_db_transaction_wrapper')
     async def dbtransactionwrappermiddleware():
         try:
             await delete(users[1].id)
@@ -33,11 +60,41 @@ async def test_dbtransactionwrappermiddleware(
     with raises(InFailedSQLTransactionError):
         async with db.transaction(force_rollback=True):
             with patch('app.middlewares._dispatch', side_effect=dispatch):
-                response = await client.post('/test_db_transaction_wrapper')
+                response = await local_client.post('/test_db_transaction_wrapper')
             assert response.status_code == 422
             await get_user(users[1].id)
 
     # middleware enabled
-    response = await client.post('/test_db_transaction_wrapper')
+    response = await local_client.post('/test_db_transaction_wrapper')
     assert response.status_code == 422
     assert await get_user(users[1].id) == users[1]
+
+
+async def test_lazy_transaction(local_app: FastAPI, local_client: AsyncClient):
+    states = []
+
+    @local_app.api_route('/test_lazy_transaction', methods=['GET', 'POST'])
+    async def lazy_transaction(query: bool = False):
+        transaction = request_transaction.get()
+        assert transaction
+        states.append(transaction.started)
+        if query:
+            await get_all()
+            states.append(transaction.started)
+        return {'readonly': transaction.readonly}
+
+    url = '/test_lazy_transaction'
+    # no queries, no transaction
+    response = await local_client.post(url)
+    assert response.status_code == 200
+    assert response.json() == {'readonly': False}
+    assert states == [False]
+
+    # the transaction starts with the first query
+    states.clear()
+    response = await local_client.get(url, params={'query': True})
+    assert response.status_code == 200
+    assert response.json() == {'readonly': True}
+    assert states == [False, True]
+
+    assert request_transaction.get() is None
@@ -0,0 +1,41 @@
+from pathlib import Path
+from shutil import copy
+
+from pytest import raises
+
+from app.migrate import load_migrations, migrate, schema_version
+from app.resources import db
+
+
+def test_load_migrations(tmp_path: Path) -> None:
+    migrations = load_migrations()
+    assert migrations[0].version == 1
+    assert migrations[0].name == 'create_user'
+    assert [m.version for m in migrations] == sorted(
+        m.version for m in migrations
+    )
+
+    (tmp_path / '0001_a.sql').touch()
+    (tmp_path / '1_b.sql').touch()
+    with raises(ValueError):
+        load_migrations(tmp_path)
+    (tmp_path / 'c.sql').touch()
+    with raises(ValueError):
+        load_migrations(tmp_path)
+
+
+async def test_migrate(app, tmp_path: Path) -> None:
+    latest = load_migrations()[-1].version
+    assert await schema_version(db) == latest
+    assert await migrate(db) == []
+
+    for migration in load_migrations():
+        copy(migration.path, tmp_path)
+    (tmp_path / '9999_create_test.sql').write_text(
+        'CREATE TABLE migration_test (id INTEGER);'
+        'CREATE INDEX ON migration_test (id);'
+    )
+    assert await migrate(db, tmp_path) == [9999]
+    assert await schema_version(db) == 9999
+    assert await db.fetch_val('SELECT count(*) FROM migration_test') == 0
+    assert await migrate(db, tmp_path) == []
@@ -0,0 +1,69 @@
+from ipaddress import ip_network
+
+from fastapi import Depends, FastAPI, Request
+from httpx import AsyncClient
+from pytest import mark, raises
+
+from app.ratelimit import STRATEGIES, client_ip, hit, query_param, rate_limit
+
+
+@mark.parametrize('strategy', STRATEGIES)
+async def test_hit(app, strategy: str) -> None:
+    for _ in range(3):
+        assert await hit('test', 3, 60, strategy) == 0
+    wait = await hit('test', 3, 60, strategy)
+    assert 0 < wait <= 60
+
+    # other keys are not affected
+    assert await hit('another test', 3, 60, strategy) == 0
+
+
+async def test_invalid_strategy(app) -> None:
+    with raises(ValueError):
+        await hit('test', 3, 60, 'leaky_bucket')
+    with raises(ValueError):
+        rate_limit('test', 3, 60, strategy='leaky_bucket')
+
+
+async def test_rate_limit_dependency(app) -> None:
+    limited_app = FastAPI()
+
+    @limited_app.get(
+        '/test_rate_limit',
+        dependencies=[Depends(rate_limit('test', 2, 60, query_param('q')))],
+    )
+    async def limited():
+        return
+
+    url = '/test_rate_limit'
+    async with AsyncClient(
+        app=limited_app, base_url='http://testserver'
+    ) as client:
+        for _ in range(2):
+            resp = await client.get(url, params={'q': 'abc'})
+            assert resp.status_code == 200
+        resp = await client.get(url, params={'q': 'ABC'})
+        assert resp.status_code == 429
+        assert 0 < int(resp.headers['retry-after']) <= 60
+
+        # without the key, there is no limit
+        resp = await client.get(url)
+        assert resp.status_code == 200
+
+
+def test_client_ip(monkeypatch) -> None:
+    def request(forwarded: str) -> Request:
+        headers = [(b'x-forwarded-for', forwarded.encode())]
+        return Request(
+            {'type': 'http', 'client': ('10.0.0.2', 1234), 'headers': headers}
+        )
+
+    forwarded = '1.1.1.1, 2.2.2.2, 10.0.0.1'
+    # not behind a trusted proxy: the header is ignored
+    assert client_ip(request(forwarded)) == '10.0.0.2'
+
+    monkeypatch.setattr('app.config.TRUSTED_PROXIES', [ip_network('10.0.0.0/8')])
+    # the client can't spoof the addresses to the left of its own
+    assert client_ip(request(forwarded)) == '2.2.2.2'
+    assert client_ip(request('10.0.0.3, 10.0.0.1')) == '10.0.0.3'
+    assert client_ip(request('')) == '10.0.0.2'
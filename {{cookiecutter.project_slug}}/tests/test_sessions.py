@@ -2,14 +2,19 @@ import json
 
 from loguru import logger
 
+from app.resources import redis
 from app.sessions import (
     create_csrf,
     create_session,
     delete_session,
+    delete_sessions,
     get_session_payload,
     is_valid_csrf,
+    list_sessions,
     session_exists,
+    session_index,
     session_keys,
+    touch_session,
 )
 
 
@@ -48,3 +53,49 @@ async def test_session_keys(app):
     keys = await session_keys('user:*')
     assert len(keys) == 2
     assert sessions[0] not in keys
+
+
+async def test_session_index(app):
+    sessions = [
+        await create_session('user:1234'),
+        await create_session('user:1234'),
+        await create_session('user:23455'),
+    ]
+
+    assert set(await list_sessions('user:1234')) == set(sessions[:2])
+    assert await list_sessions('user:23455') == [sessions[2]]
+
+    await delete_session(sessions[0])
+    assert await list_sessions('user:1234') == [sessions[1]]
+
+    await delete_sessions('user:1234')
+    assert await list_sessions('user:1234') == []
+    assert not await session_exists(sessions[1])
+    assert not await redis.exists(session_index('user:1234'))
+    assert await session_exists(sessions[2])
+
+
+async def test_touch_session(app, monkeypatch) -> None:
+    session_id = await create_session('user:1234', lifetime=100)
+    await redis.set('user:1234', 'cached')
+    assert await touch_session(session_id, 'user:1234', 'nothing') == [
+        b'cached',
+        None,
+    ]
+    assert await touch_session('user:1234:unknown', 'user:1234') is None
+
+    # fixed sessions are never extended
+    assert await touch_session(session_id) == []
+    assert await redis.ttl(session_id) <= 100
+
+    # sliding sessions are only extended below the threshold
+    monkeypatch.setattr('app.config.SESSION_SLIDING', True)
+    monkeypatch.setattr('app.config.SESSION_LIFETIME', 1000)
+    monkeypatch.setattr('app.config.SESSION_REFRESH_THRESHOLD', 50)
+    await touch_session(session_id)
+    assert await redis.ttl(session_id) <= 100
+    monkeypatch.setattr('app.config.SESSION_REFRESH_THRESHOLD', 500)
+    await touch_session(session_id)
+    assert await redis.ttl(session_id) > 900
+    assert session_id in await list_sessions('user:1234')
+    assert await redis.ttl(session_index('user:1234')) > 900
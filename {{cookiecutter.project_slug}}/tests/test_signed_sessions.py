@@ -0,0 +1,85 @@
+from time import time
+
+from httpx import AsyncClient
+
+from app import config
+from app.resources import redis
+from app.schemas.user import UserInfo
+from app.sessions import create_csrf
+from app.signed_sessions import DENYLIST, Denylist, create_token, parse_token
+
+Users = list[UserInfo]
+PASSWORD = 'Paulo Paulada Power'
+
+
+def test_token(monkeypatch) -> None:
+    session_id = create_token('user:1234', lifetime=60)
+    token = parse_token(session_id)
+    assert token and token.prefix == 'user:1234'
+    assert token.expires - token.issued == 60
+
+    # tampered or malformed
+    assert parse_token(session_id.replace('user:1234', 'user:4321')) is None
+    assert parse_token(session_id[:-1]) is None
+    assert parse_token('user:1234:abcdef') is None
+    assert parse_token('user:1234:1.9999999999.ção') is None
+    assert parse_token('') is None
+
+    # expired
+    assert parse_token(create_token('user:1234', lifetime=-1)) is None
+
+    # key rotation
+    old_key = config.SECRET_KEY
+    monkeypatch.setattr('app.config.SECRET_KEY', b'new key')
+    assert parse_token(session_id) is None
+    monkeypatch.setattr('app.config.PREVIOUS_SECRET_KEYS', [old_key])
+    assert parse_token(session_id) == token
+
+
+async def test_denylist(app) -> None:
+    denylist = Denylist()
+    other_process = Denylist()
+    token = parse_token(create_token('user:1234'))
+    assert token and not denylist.is_revoked(token)
+
+    await denylist.revoke(redis, token.signature, token.expires)
+    assert denylist.is_revoked(token)
+    assert not other_process.is_revoked(token)
+    await other_process.refresh(redis)
+    assert other_process.is_revoked(token)
+
+    # all tokens of a prefix issued up to the revocation
+    another = parse_token(create_token('user:1234'))
+    assert another and not denylist.is_revoked(another)
+    await denylist.revoke(redis, 'user:1234', int(time()))
+    assert denylist.is_revoked(another)
+
+    # expired entries are dropped
+    await redis.hset(DENYLIST, 'expired', int(time()) - 1)
+    await denylist.refresh(redis)
+    assert 'expired' not in denylist.entries
+    assert not await redis.hexists(DENYLIST, 'expired')
+
+
+async def test_signed_session(
+    users: Users, client: AsyncClient, monkeypatch
+) -> None:
+    monkeypatch.setattr('app.config.SESSION_BACKEND', 'signed')
+    resp = await client.post(
+        '/login', json={'email': users[0].email, 'password': PASSWORD}
+    )
+    assert resp.status_code == 200
+    session_id = resp.cookies['session_id']
+    assert parse_token(session_id)
+    assert not await redis.exists(session_id)
+
+    cookies = {'session_id': session_id}
+    headers = {'x-csrf-token': create_csrf(session_id)}
+    resp = await client.get('/users/me', cookies=cookies, headers=headers)
+    assert resp.status_code == 200
+    assert resp.json()['id'] == users[0].id
+
+    resp = await client.post('/logout', cookies=cookies)
+    assert resp.status_code == 204
+    resp = await client.get('/users/me', cookies=cookies, headers=headers)
+    assert resp.status_code == 401
@@ -0,0 +1,128 @@
+from pathlib import Path
+
+import orjson as json
+from httpx import AsyncClient
+from pytest import raises
+
+from app.schemas.user import UserInfo
+from app.tracing import (
+    Exporter,
+    child_span,
+    current_span,
+    end_trace,
+    finish,
+    parse_traceparent,
+    span,
+    start_trace,
+)
+
+Users = list[UserInfo]
+PASSWORD = 'Paulo Paulada Power'
+TRACE_ID = '4bf92f3577b34da6a3ce929d0e0e4736'
+PARENT_ID = '00f067aa0ba902b7'
+
+
+def test_parse_traceparent() -> None:
+    assert parse_traceparent(f'00-{TRACE_ID}-{PARENT_ID}-01') == (
+        int(TRACE_ID, 16),
+        int(PARENT_ID, 16),
+        True,
+    )
+    parent = parse_traceparent(f'00-{TRACE_ID}-{PARENT_ID}-00')
+    assert parent is not None
+    assert parent[2] is False
+    assert parse_traceparent(f'00-{"0" * 32}-{PARENT_ID}-01') is None
+    assert parse_traceparent(f'00-{TRACE_ID}-xyz-01') is None
+    assert parse_traceparent('') is None
+
+
+def test_span_outside_trace() -> None:
+    with span('nothing') as current:
+        assert current is None
+
+
+def test_span(monkeypatch, tmp_path: Path) -> None:
+    path = tmp_path / 'traces.jsonl'
+    exporter = Exporter(str(path), 1000)
+    monkeypatch.setattr('app.tracing.exporter', exporter)
+    monkeypatch.setattr('app.config.TRACE_SAMPLE_RATE', 1)
+
+    trace = start_trace('root')
+    assert trace is not None
+    root, _ = trace
+    with raises(ValueError):
+        with span('outer') as outer:
+            assert outer is not None
+            assert current_span.get() is outer
+            with span('inner') as inner:
+                assert inner is not None
+                assert inner.parent_id == outer.span_id
+            raise ValueError()
+    assert current_span.get() is root
+    detached = child_span('detached')
+    assert detached is not None
+    assert current_span.get() is root
+    finish(detached)
+    end_trace(trace)
+    assert current_span.get() is None
+
+    spans = {s['name']: s for s in read_spans(exporter, path)}
+    assert spans.keys() == {'root', 'outer', 'inner', 'detached'}
+    assert spans['outer']['status']['message'] == 'ValueError()'
+    assert 'status' not in spans['inner']
+    assert spans['detached']['parentSpanId'] == spans['root']['spanId']
+
+
+def read_spans(exporter: Exporter, path: Path) -> list[dict]:
+    exporter.flush()
+    spans = []
+    for line in path.read_bytes().splitlines():
+        request = json.loads(line)
+        for resource_spans in request['resourceSpans']:
+            for scope_spans in resource_spans['scopeSpans']:
+                spans.extend(scope_spans['spans'])
+    path.write_bytes(b'')
+    return spans
+
+
+async def test_trace_request(
+    users: Users, client: AsyncClient, monkeypatch, tmp_path: Path
+) -> None:
+    path = tmp_path / 'traces.jsonl'
+    exporter = Exporter(str(path), 1000)
+    monkeypatch.setattr('app.tracing.exporter', exporter)
+    monkeypatch.setattr('app.config.TRACE_SAMPLE_RATE', 1)
+
+    resp = await client.post(
+        '/login', json={'email': users[0].email, 'password': PASSWORD}
+    )
+    assert resp.status_code == 200
+    spans = read_spans(exporter, path)
+    root = next(s for s in spans if 'parentSpanId' not in s)
+    assert root['name'] == 'POST /login'
+    assert root['kind'] == 2
+    assert {'key': 'http.status_code', 'value': {'intValue': '200'}} in (
+        root['attributes']
+    )
+    names = {s['name'] for s in spans}
+    assert 'postgres fetch_one' in names
+    assert 'hashing _verify' in names
+    assert any(name.startswith('redis ') for name in names)
+    for s in spans:
+        assert s['traceId'] == root['traceId']
+        assert int(s['endTimeUnixNano']) >= int(s['startTimeUnixNano'])
+    span_ids = {s['spanId'] for s in spans}
+    assert all(s['parentSpanId'] in span_ids for s in spans if s is not root)
+
+    # the caller decides
+    traceparent = f'00-{TRACE_ID}-{PARENT_ID}-00'
+    await client.get('/users/me', headers={'traceparent': traceparent})
+    assert read_spans(exporter, path) == []
+
+    traceparent = f'00-{TRACE_ID}-{PARENT_ID}-01'
+    monkeypatch.setattr('app.config.TRACE_SAMPLE_RATE', 0.0000001)
+    await client.get('/users/me', headers={'traceparent': traceparent})
+    spans = read_spans(exporter, path)
+    root = next(s for s in spans if s.get('parentSpanId') == PARENT_ID)
+    assert root['traceId'] == TRACE_ID
+    assert root['name'] == 'GET /users/me'
@@ -0,0 +1,86 @@
+from typing import AsyncIterator
+
+import orjson as json
+from httpx import AsyncClient
+
+from app.database import run_detached
+from app.models.user import delete, get_user_by_email, get_user_by_login
+from app.schemas.user import UserInfo
+from app.user_import import import_users, parse
+
+from .utils import logged_session
+
+Users = list[UserInfo]
+PASSWORD = 'Paulo Paulada Power'
+
+
+async def stream(*chunks: bytes) -> AsyncIterator[bytes]:
+    for chunk in chunks:
+        yield chunk
+
+
+async def test_parse() -> None:
+    # lines split across chunks
+    chunks = stream(b'name,email,pass', b'word\nFulano,', b'fulano@email.com,1')
+    rows = [row async for row in parse(chunks, 'csv')]
+    assert rows == [
+        (2, {'name': 'Fulano', 'email': 'fulano@email.com', 'password': '1'})
+    ]
+
+    rows = [row async for row in parse(stream(b'{"a": 1}\n\n{nope\n'), 'ndjson')]
+    assert rows[0] == (1, {'a': 1})
+    assert rows[1][0] == 3 and isinstance(rows[1][1], ValueError)
+
+
+async def test_import_users(users: Users, monkeypatch) -> None:
+    monkeypatch.setattr('app.config.IMPORT_BATCH_SIZE', 2)
+    rows = [
+        {'name': 'Ciclano', 'email': 'ciclano@email.com', 'password': PASSWORD},
+        {'name': 'Existing', 'email': users[0].email, 'password': PASSWORD},
+        {'name': 'Invalid', 'email': 'invalid email', 'password': PASSWORD},
+        {'name': 'Zutano', 'email': 'zutano@email.com', 'password': PASSWORD},
+        {'name': 'Ciclano 2', 'email': 'ciclano@email.com', 'password': PASSWORD},
+        {'name': 'Sicrano', 'email': 'sicrano@email.com', 'password': PASSWORD},
+        {'name': 'Sicrano 2', 'email': 'sicrano@email.com', 'password': PASSWORD},
+    ]
+    body = b'\n'.join(json.dumps(row) for row in rows)
+    report = await import_users(stream(body, b'\nnot json'))
+
+    assert report.imported == 3
+    assert report.duplicates == [
+        users[0].email,
+        'ciclano@email.com',
+        'sicrano@email.com',
+    ]
+    assert [error.line for error in report.errors] == [3, 8]
+
+    user = await get_user_by_login('zutano@email.com', PASSWORD)
+    assert user and user.name == 'Zutano'
+    user = await get_user_by_email('ciclano@email.com')
+    assert user and user.name == 'Ciclano'
+    user = await get_user_by_email(users[0].email)
+    assert user and user.name == users[0].name
+
+
+async def test_import_endpoint(
+    users: Users, client: AsyncClient, monkeypatch
+) -> None:
+    body = f'name,email,password\nCiclano,ciclano@email.com,{PASSWORD}\n'
+
+    await logged_session(client, users[0].id)
+    resp = await client.post('/users/import?format=csv', content=body)
+    assert resp.status_code == 403
+
+    monkeypatch.setattr('app.config.ADMIN_EMAILS', {users[0].email.lower()})
+    resp = await client.post('/users/import?format=xml', content=body)
+    assert resp.status_code == 422
+    resp = await client.post('/users/import?format=csv', content=body)
+    # committed outside the transaction that wraps the test
+    user = await get_user_by_email('ciclano@email.com')
+    try:
+        assert resp.status_code == 200
+        assert resp.json() == {'imported': 1, 'duplicates': [], 'errors': []}
+        assert user
+    finally:
+        if user:
+            await run_detached(delete(user.id))